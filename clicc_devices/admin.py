@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Set, ItemType
+from .device_data import rebuild_device_summary
+from .models import RetrievalRun, Set, SetRetrieval, ItemType
 
 
 @admin.register(Set)
@@ -9,9 +10,68 @@ class SetAdmin(admin.ModelAdmin):
     list_filter = ("type", "unit")
     ordering = ("name",)
 
+    # Changes to a set's unit or type, or removing a set, affect the
+    # device counts, so keep the summary used by /devices/ in sync.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild_device_summary()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_device_summary()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        rebuild_device_summary()
+
 
 @admin.register(ItemType)
 class ItemTypeAdmin(admin.ModelAdmin):
     list_display = ("name",)
     search_fields = ("name",)
     ordering = ("name",)
+
+    # Summary rows store the item type by name, so renames must be reflected.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild_device_summary()
+
+
+class SetRetrievalInline(admin.TabularInline):
+    model = SetRetrieval
+    fields = (
+        "name",
+        "alma_set_id",
+        "result",
+        "alma_seconds",
+        "write_seconds",
+        "added",
+        "removed",
+        "unchanged",
+        "error",
+    )
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+# Retrieval history is written by retrieve_sets; the admin only reads and deletes it.
+# The summary and slowest sets are on the Retrievals page.
+@admin.register(RetrievalRun)
+class RetrievalRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "started",
+        "finished",
+        "options",
+        "sets_synced",
+        "sets_skipped",
+        "sets_failed",
+    )
+    readonly_fields = list_display
+    inlines = (SetRetrievalInline,)
+
+    def has_add_permission(self, request):
+        return False
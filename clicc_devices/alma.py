@@ -0,0 +1,144 @@
+from collections.abc import Iterator
+import hashlib
+import json
+import requests
+import time
+from types import SimpleNamespace
+from clicc_devices.metrics import metrics
+from clicc_devices.retrieval import RateLimiter
+
+# Alma REST API, North America region.
+ALMA_API_URL = "https://api-na.hosted.exlibrisgroup.com/almaws/v1"
+# Alma returns at most 100 set members per request.
+MAX_PAGE_SIZE = 100
+
+
+class AlmaRequestError(Exception):
+    """Raised when Alma responds to a request with an error, or a request
+    to Alma fails, like a timeout or an unreadable response.
+
+    Like alma_api_client.APIError, error_messages has the messages from Alma.
+    """
+
+    def __init__(self, error_messages: list[str]) -> None:
+        super().__init__("; ".join(error_messages))
+        self.error_messages = error_messages
+
+
+class AlmaSetMembersClient:
+    """Reads Alma set members page by page, directly from the Alma API.
+
+    iter_member_pages() lets callers process each page before requesting
+    the next; get_set() reads them all, like alma_api_client.AlmaAPIClient.get_set().
+    Either way, every page is a separate request, subject to the rate limiter.
+
+    :param api_key: Alma API key.
+    :param rate_limiter: Optional RateLimiter, applied to every request.
+    :param timeout: Seconds to wait for each response.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        rate_limiter: RateLimiter | None = None,
+        timeout: float = 60,
+    ) -> None:
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Authorization": f"apikey {api_key}", "Accept": "application/json"}
+        )
+
+    def iter_member_pages(
+        self, alma_set_id: str, page_size: int = MAX_PAGE_SIZE
+    ) -> Iterator[list[str]]:
+        """Get the barcodes of a set's members, one page at a time.
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per request, up to MAX_PAGE_SIZE.
+        :return: Iterator of lists of barcodes.
+        """
+        page_size = min(page_size, MAX_PAGE_SIZE)
+        offset = 0
+        while True:
+            data = self._get(
+                f"/conf/sets/{alma_set_id}/members",
+                {"limit": page_size, "offset": offset},
+            )
+            members = data.get("member", [])
+            if not members:
+                return
+            # As with alma_api_client, the member description is the item barcode.
+            yield [member["description"] for member in members]
+            offset += len(members)
+            if offset >= data.get("total_record_count", 0):
+                return
+
+    def get_set(
+        self, alma_set_id: str, page_size: int = MAX_PAGE_SIZE
+    ) -> SimpleNamespace:
+        """Get a set with all of its members, like AlmaAPIClient.get_set().
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per request, up to MAX_PAGE_SIZE.
+        :return: Object with a members list; each member's description is a barcode.
+        """
+        return SimpleNamespace(
+            members=[
+                SimpleNamespace(description=barcode)
+                for page in self.iter_member_pages(alma_set_id, page_size)
+                for barcode in page
+            ]
+        )
+
+    def get_set_fingerprint(self, alma_set_id: str) -> str:
+        """Get a fingerprint of a set's metadata, with a single request.
+
+        The fingerprint changes when the number of members, the set's status date
+        or its query changes. Replacing members without changing their number
+        is not detected, so sets should still be fully retrieved regularly.
+
+        :param alma_set_id: Alma set ID.
+        :return: Hex digest of the relevant metadata.
+        """
+        data = self._get(f"/conf/sets/{alma_set_id}", {})
+        metadata = {
+            "number_of_members": data.get("number_of_members", {}).get("value"),
+            "status_date": data.get("status_date"),
+            "query": data.get("query", {}).get("value"),
+        }
+        return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+    def _get(self, path: str, params: dict) -> dict:
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                f"{ALMA_API_URL}{path}", params=params, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            # Timeouts and dropped connections fail this set, like Alma errors.
+            raise AlmaRequestError([f"Request to Alma failed: {e}"]) from e
+        finally:
+            metrics.observe(
+                "clicc_devices_alma_request_duration_seconds",
+                time.perf_counter() - start,
+            )
+        if not response.ok:
+            raise AlmaRequestError(self._error_messages(response))
+        try:
+            return response.json()
+        except ValueError as e:
+            raise AlmaRequestError(
+                [f"Alma returned invalid JSON (HTTP {response.status_code})"]
+            ) from e
+
+    @staticmethod
+    def _error_messages(response: requests.Response) -> list[str]:
+        try:
+            errors = response.json()["errorList"]["error"]
+            return [error["errorMessage"] for error in errors]
+        except (ValueError, KeyError, TypeError):
+            return [f"HTTP {response.status_code}: {response.reason}"]
@@ -0,0 +1,249 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from types import SimpleNamespace
+from clicc_devices.alma import AlmaRequestError, MAX_PAGE_SIZE
+from clicc_devices.file_utils import write_atomic
+
+# Stand-ins for the Alma clients used by retrieve_sets, so it can be run, load tested
+# and profiled without network access. Like the live clients, they provide:
+# * get_set(), returning an object whose members have barcodes as descriptions,
+# * iter_member_pages() and get_set_fingerprint(),
+# like AlmaSetMembersClient.
+
+
+class OfflineAlmaClient(ABC):
+    """Base class for clients which serve sets without calling Alma.
+
+    Every simulated request to Alma waits for latency seconds, then fails
+    with AlmaRequestError at the given rate.
+
+    :param latency: Seconds each simulated request takes.
+    :param page_size: Members per simulated request by get_set(),
+        up to MAX_PAGE_SIZE, as Alma returns.
+    :param error_rate: Fraction of simulated requests which fail, from 0 to 1.
+    :param seed: Seed for choosing which requests fail, for repeatable runs.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        page_size: int = MAX_PAGE_SIZE,
+        error_rate: float = 0,
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def get_set(
+        self, alma_set_id: str, page_size: int | None = None
+    ) -> SimpleNamespace:
+        """Get a set with all of its members, like AlmaSetMembersClient.get_set().
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per simulated request, up to MAX_PAGE_SIZE;
+            default self.page_size.
+        :return: Object with a members list; each member's description is a barcode.
+        """
+        page_size = min(page_size or self.page_size, MAX_PAGE_SIZE)
+        barcodes = self.set_barcodes(alma_set_id)
+        for _ in range(max(math.ceil(len(barcodes) / page_size), 1)):
+            self._simulate_request()
+        return SimpleNamespace(
+            members=[SimpleNamespace(description=barcode) for barcode in barcodes]
+        )
+
+    def iter_member_pages(
+        self, alma_set_id: str, page_size: int = MAX_PAGE_SIZE
+    ) -> Iterator[list[str]]:
+        """Get the barcodes of a set's members, one page at a time.
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per request, up to MAX_PAGE_SIZE.
+        :return: Iterator of lists of barcodes.
+        """
+        page_size = min(page_size, MAX_PAGE_SIZE)
+        barcodes = self.set_barcodes(alma_set_id)
+        for offset in range(0, len(barcodes), page_size):
+            self._simulate_request()
+            yield barcodes[offset : offset + page_size]
+
+    def get_set_fingerprint(self, alma_set_id: str) -> str:
+        """Get a fingerprint of a set, with a single simulated request.
+
+        :param alma_set_id: Alma set ID.
+        :return: Hex digest, which changes when the set's members change.
+        """
+        self._simulate_request()
+        return self.set_fingerprint(alma_set_id)
+
+    @abstractmethod
+    def set_barcodes(self, alma_set_id: str) -> list[str]:
+        """Get the barcodes of a set's members, without a simulated request.
+
+        :param alma_set_id: Alma set ID.
+        :return: List of barcodes.
+        """
+
+    def set_fingerprint(self, alma_set_id: str) -> str:
+        """Get a set's fingerprint, without a simulated request.
+
+        :param alma_set_id: Alma set ID.
+        :return: Hex digest of the set's barcodes.
+        """
+        barcodes = "\n".join(self.set_barcodes(alma_set_id))
+        return hashlib.sha256(barcodes.encode()).hexdigest()
+
+    def _simulate_request(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise AlmaRequestError(["Simulated Alma error"])
+
+
+class FakeAlmaClient(OfflineAlmaClient):
+    """Serves synthetic sets, each with the same number of members.
+
+    Barcodes are generated from the set ID. With churn, that fraction of each
+    set's barcodes is replaced by others, as if items had been added to and
+    removed from the set in Alma. Which members are replaced, and by what,
+    depends on the run, so consecutive runs see different changes; the same
+    run always sees the same ones.
+
+    :param items_per_set: Number of members in each set.
+    :param churn: Fraction of members replaced, from 0 to 1.
+    :param run: Number of the run, like a count of earlier runs.
+    Other parameters are as for OfflineAlmaClient.
+    """
+
+    def __init__(
+        self, items_per_set: int = 1000, churn: float = 0, run: int = 0, **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        self.items_per_set = items_per_set
+        self.churn = churn
+        self.run = run
+
+    def set_barcodes(self, alma_set_id: str) -> list[str]:
+        barcodes = [f"{alma_set_id}-I{i:07}" for i in range(self.items_per_set)]
+        changed = int(self.items_per_set * self.churn)
+        # Seeded with the run and set, so each set changes independently.
+        run_random = random.Random(f"{self.run}:{alma_set_id}")
+        for i in run_random.sample(range(self.items_per_set), changed):
+            barcodes[i] = f"{alma_set_id}-R{self.run}-{i:07}"
+        return barcodes
+
+
+class ReplayAlmaClient(OfflineAlmaClient):
+    """Serves sets saved by RecordingAlmaClient.
+
+    Sets without a recording fail with AlmaRequestError, like unknown sets in Alma.
+
+    :param directory: Directory of recordings.
+    Other parameters are as for OfflineAlmaClient.
+    """
+
+    def __init__(self, directory: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.directory = directory
+
+    def set_barcodes(self, alma_set_id: str) -> list[str]:
+        return self._recording(alma_set_id)["members"]
+
+    def set_fingerprint(self, alma_set_id: str) -> str:
+        # Replay the fingerprint from Alma, if one was recorded.
+        recording = self._recording(alma_set_id)
+        return recording.get("fingerprint") or super().set_fingerprint(alma_set_id)
+
+    def _recording(self, alma_set_id: str) -> dict:
+        try:
+            with open(recording_path(self.directory, alma_set_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise AlmaRequestError([f"No recording of set {alma_set_id}"])
+
+
+class RecordingAlmaClient:
+    """Passes requests to the live Alma client, saving the sets it returns,
+    for ReplayAlmaClient.
+
+    Each set is saved as JSON, with its members' barcodes and, if it was
+    requested, its fingerprint.
+
+    :param client: Live client, like AlmaSetMembersClient.
+    :param directory: Directory to save recordings in.
+    """
+
+    def __init__(self, client, directory: str) -> None:
+        self.client = client
+        self.directory = directory
+
+    def get_set(self, alma_set_id: str, page_size: int = MAX_PAGE_SIZE):
+        """Get a set from the live client, saving its members' barcodes.
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per request, up to MAX_PAGE_SIZE.
+        :return: The set returned by the live client.
+        """
+        alma_set = self.client.get_set(alma_set_id, page_size=page_size)
+        barcodes = [member.description for member in alma_set.members]
+        self._save(alma_set_id, members=barcodes)
+        return alma_set
+
+    def iter_member_pages(
+        self, alma_set_id: str, page_size: int = MAX_PAGE_SIZE
+    ) -> Iterator[list[str]]:
+        """Get pages of barcodes from the live client, saving the set's
+        barcodes once the last page has been read.
+
+        :param alma_set_id: Alma set ID.
+        :param page_size: Members per request, up to MAX_PAGE_SIZE.
+        :return: Iterator of lists of barcodes.
+        """
+        barcodes = []
+        for page in self.client.iter_member_pages(alma_set_id, page_size):
+            barcodes.extend(page)
+            yield page
+        # Only complete sets are saved.
+        self._save(alma_set_id, members=barcodes)
+
+    def get_set_fingerprint(self, alma_set_id: str) -> str:
+        """Get a set's fingerprint from the live client, saving it.
+
+        :param alma_set_id: Alma set ID.
+        :return: Hex digest of the set's metadata.
+        """
+        fingerprint = self.client.get_set_fingerprint(alma_set_id)
+        self._save(alma_set_id, fingerprint=fingerprint)
+        return fingerprint
+
+    def _save(self, alma_set_id: str, **data) -> None:
+        path = recording_path(self.directory, alma_set_id)
+        try:
+            with open(path) as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            recording = {"alma_set_id": alma_set_id, "members": []}
+        recording.update(data)
+        os.makedirs(self.directory, exist_ok=True)
+        # A failed run never leaves a partial recording.
+        write_atomic(path, json.dumps(recording).encode())
+
+
+def recording_path(directory: str, alma_set_id: str) -> str:
+    """Get the path of a set's recording.
+
+    :param directory: Directory of recordings.
+    :param alma_set_id: Alma set ID.
+    :return: Path to the recording's JSON file.
+    """
+    # Alma set IDs are numeric, but don't trust them as file names.
+    safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in alma_set_id)
+    return os.path.join(directory, f"{safe_id}.json")
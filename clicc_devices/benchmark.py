@@ -0,0 +1,221 @@
+from collections.abc import Callable
+import logging
+import statistics
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from clicc_devices.alma_offline import FakeAlmaClient
+from clicc_devices.device_data import (
+    DEVICES_CACHE,
+    DEVICES_STATE_CACHE,
+    rebuild_device_summary,
+)
+from clicc_devices.models import Item, ItemType, Set
+
+# Benchmarks run with in-memory caches, and a temporary export directory,
+# so they don't touch the real /devices/ cache or export.
+BENCHMARK_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    DEVICES_CACHE: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-devices",
+    },
+    DEVICES_STATE_CACHE: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-devices-state",
+    },
+}
+# Items created per INSERT when generating data.
+GENERATE_BATCH_SIZE = 5000
+
+
+def generate_data(set_count: int, items_per_set: int, units: int, types: int) -> None:
+    """Create synthetic Sets, spread evenly across units and types, with items.
+
+    :param set_count: Number of Sets.
+    :param items_per_set: Number of Items in each Set.
+    :param units: Number of distinct units.
+    :param types: Number of distinct ItemTypes.
+    :return: None
+    """
+    item_types = ItemType.objects.bulk_create(
+        [ItemType(name=f"Benchmark type {i}") for i in range(types)]
+    )
+    sets = Set.objects.bulk_create(
+        [
+            Set(
+                alma_set_id=f"benchmark-{i}",
+                name=f"Benchmark set {i}",
+                unit=f"Benchmark unit {i % units}",
+                type=item_types[i % types],
+                retrieved=timezone.now(),
+            )
+            for i in range(set_count)
+        ]
+    )
+    # The same items the fake Alma client returns, before churn.
+    alma_client = FakeAlmaClient(items_per_set=items_per_set)
+    items = []
+    for set_obj in sets:
+        for barcode in alma_client.set_barcodes(set_obj.alma_set_id):
+            items.append(Item(set=set_obj, barcode=barcode))
+            if len(items) == GENERATE_BATCH_SIZE:
+                Item.objects.bulk_create(items)
+                items = []
+    Item.objects.bulk_create(items)
+    rebuild_device_summary()
+
+
+def measure(function: Callable[[], object], repeat: int = 1) -> dict:
+    """Run a function, measuring wall time, CPU time, database queries and peak memory.
+
+    Queries are counted on this thread's database connection only. CPU time
+    is this process's, so it includes work by other threads, like retrieve_sets
+    workers, but not by the database server.
+    Memory is traced with tracemalloc, which slows the function down;
+    compare wall times only between runs of this benchmark.
+
+    :param function: Function to run, without arguments.
+    :param repeat: Number of times to run it.
+    :return: Dictionary with "runs", wall time statistics in seconds
+        ("min_seconds", "median_seconds", "max_seconds"), "median_cpu_seconds",
+        "queries" for each run, and "peak_memory_bytes" across all runs.
+    """
+    wall_times = []
+    cpu_times = []
+    query_counts = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            queries = 0
+
+            def count_query(execute, sql, params, many, context):
+                nonlocal queries
+                queries += 1
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count_query):
+                start = time.perf_counter()
+                cpu_start = time.process_time()
+                function()
+                cpu_times.append(time.process_time() - cpu_start)
+                wall_times.append(time.perf_counter() - start)
+            query_counts.append(queries)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "runs": repeat,
+        "min_seconds": min(wall_times),
+        "median_seconds": statistics.median(wall_times),
+        "max_seconds": max(wall_times),
+        "median_cpu_seconds": statistics.median(cpu_times),
+        "queries": query_counts,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def run_benchmark(
+    set_count: int = 500,
+    items_per_set: int = 5000,
+    units: int = 20,
+    types: int = 10,
+    repeat: int = 5,
+    churn: float = 0.05,
+    retrieve_options: dict | None = None,
+    accept_encoding: str = "gzip, br",
+) -> dict:
+    """Generate synthetic data in the current database, then measure
+    /devices/, the Sets page and retrieve_sets against a fake Alma client.
+
+    Run this against a test database: it adds data and replaces Items.
+
+    :param set_count: Number of Sets to generate.
+    :param items_per_set: Number of Items in each Set.
+    :param units: Number of distinct units.
+    :param types: Number of distinct ItemTypes.
+    :param repeat: Number of times each page is requested.
+    :param churn: Fraction of each set's members changed in the fake Alma client.
+    :param retrieve_options: Extra options for the retrieve_sets command,
+        like {"workers": 4, "stream": True}. Not rate limited by default.
+    :param accept_encoding: Accept-Encoding header sent with page requests;
+        empty for uncompressed responses.
+    :return: Dictionary of results from measure(), by benchmark name. Page
+        results also have "response_bytes", the size of the last response's body
+        as sent, and its "content_encoding", or None if it wasn't compressed.
+    """
+    results = {}
+    # The fake Alma client makes no requests, so don't slow it down to Alma's rate.
+    retrieve_options = {"max_requests_per_second": 0, **(retrieve_options or {})}
+    # Application logging (like retrieve_sets' progress) would otherwise add
+    # thousands of lines to the real log, and its cost to every result.
+    logging.disable(logging.INFO)
+    try:
+        with (
+            tempfile.TemporaryDirectory() as export_dir,
+            override_settings(CACHES=BENCHMARK_CACHES, DEVICES_EXPORT_DIR=export_dir),
+        ):
+            results["generate_data"] = measure(
+                lambda: generate_data(set_count, items_per_set, units, types)
+            )
+
+            headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+            client = Client(headers=headers)
+            user = User.objects.create_user("benchmark")
+            client.force_login(user)
+            devices_cache = caches[DEVICES_CACHE]
+            sets_url = reverse("view_sets")
+
+            last_response = {}
+
+            def get(path: str, data: dict | None = None) -> None:
+                response = client.get(path, data)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}")
+                last_response["response_bytes"] = len(response.content)
+                last_response["content_encoding"] = response.get("Content-Encoding")
+
+            def measure_page(name: str, function: Callable[[], None]) -> None:
+                results[name] = {**measure(function, repeat), **last_response}
+
+            def get_devices_uncached() -> None:
+                devices_cache.clear()
+                get("/devices/")
+
+            measure_page("devices_uncached", get_devices_uncached)
+            measure_page("devices_cached", lambda: get("/devices/"))
+            measure_page("view_sets", lambda: get(sets_url))
+            measure_page(
+                "view_sets_sorted_by_item_count",
+                lambda: get(sets_url, {"sort": "-item_count"}),
+            )
+            measure_page(
+                "view_sets_filtered",
+                lambda: get(
+                    sets_url,
+                    {"unit": "Benchmark unit 0", "type": "Benchmark type 0"},
+                ),
+            )
+
+            results["retrieve_sets"] = measure(
+                lambda: call_command(
+                    "retrieve_sets",
+                    client="fake",
+                    fake_items_per_set=items_per_set,
+                    fake_churn=churn,
+                    stdout=StringIO(),
+                    **retrieve_options,
+                )
+            )
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
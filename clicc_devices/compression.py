@@ -0,0 +1,109 @@
+from collections.abc import Iterable, Iterator
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings this application can produce, in order of preference.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# Media types worth compressing; others, like images, are compressed already.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+# Compressed bodies are only used if they save at least this fraction,
+# as in WhiteNoise's own compression.
+MIN_COMPRESSION_SAVING = 0.05
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data with a content coding.
+
+    The result is the same for the same data, so it can be cached and hashed.
+
+    :param data: Data to compress.
+    :param encoding: "gzip", or "br" if brotli is installed.
+    :return: Compressed data.
+    """
+    if encoding == "br":
+        return brotli.compress(data)
+    # mtime=0, so the gzip header doesn't change with the time.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_variants(data: bytes, min_bytes: int = 0) -> dict[str, bytes]:
+    """Compress data with every available content coding which is worth using.
+
+    :param data: Data to compress.
+    :param min_bytes: Don't compress data shorter than this.
+    :return: Dictionary of {encoding: compressed data}, like {"gzip": b"..."}.
+    """
+    if len(data) < min_bytes:
+        return {}
+    variants = {encoding: compress(data, encoding) for encoding in ENCODINGS}
+    return {
+        encoding: compressed
+        for encoding, compressed in variants.items()
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING)
+    }
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a stream of chunks, flushing after each one.
+
+    Each chunk is sent as soon as it's compressed, rather than held back
+    for a better ratio, so streamed responses arrive as promptly as without
+    compression.
+
+    :param chunks: Data to compress.
+    :param encoding: "gzip", or "br" if brotli is installed.
+    :return: Iterator of compressed data.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        # wbits=31: gzip header and trailer, with a 32 KiB window.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def negotiate_encoding(
+    accept_encoding: str, available: Iterable[str] = ENCODINGS
+) -> str | None:
+    """Choose a content coding the client accepts, from an Accept-Encoding header.
+
+    Codings are chosen in our order of preference, not the client's, among
+    those it accepts with a q value above 0, directly or through "*".
+
+    :param accept_encoding: Accept-Encoding header value, like "gzip, br;q=0.9".
+    :param available: Encodings to choose from, in order of preference.
+    :return: Chosen encoding, or None to send the response uncompressed.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if coding.strip():
+            accepted[coding.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Max, QuerySet
+from django.utils import timezone
+from django.utils.http import quote_etag
+from clicc_devices.compression import compress_variants
+from clicc_devices.devices_export import export_devices
+from clicc_devices.metrics import format_labels, metrics
+from clicc_devices.models import (
+    DeviceCountSnapshot,
+    DeviceSummary,
+    Item,
+    MetricSample,
+    Set,
+)
+
+logger = logging.getLogger(__name__)
+
+# Name of the cache (in settings.CACHES) shared by all processes.
+DEVICES_CACHE = "devices"
+# Cache for the generation of filtered payloads, which must not be culled
+# along with them, shared by all processes.
+DEVICES_STATE_CACHE = "devices_state"
+DEVICES_PAYLOAD_KEY = "devices:payload"
+# Counter in /metrics/ of /devices/ cache hits and misses.
+DEVICES_CACHE_METRIC = "clicc_devices_devices_cache_requests_total"
+# /devices/ payloads are cached per summary generation.
+DEVICES_GENERATION_KEY = "devices:generation"
+DEVICES_VARIANT_TIMEOUT = 24 * 60 * 60
+
+
+def aggregate_device_counts() -> QuerySet:
+    """Count items per unit and item type, directly from Sets and Items.
+
+    This is one grouped query, with a LEFT JOIN to items so sets
+    without any items still report a count of 0.
+
+    :return: Queryset of dicts with unit, type__name, item_count and retrieved.
+    """
+    return (
+        Set.objects.values("unit", "type__name")
+        .annotate(item_count=Count("items"), retrieved=Max("retrieved"))
+        .order_by("unit", "type__name")
+    )
+
+
+def rebuild_device_summary() -> int:
+    """Replace the contents of the DeviceSummary table with fresh counts.
+
+    The old rows are deleted and the new ones inserted in a single transaction,
+    so readers see either the previous summary or the new one, never a mix.
+    Once committed, the cached /devices/ payload is replaced as well.
+
+    :return: The number of summary rows written.
+    """
+    built = timezone.now()
+    rows = [
+        DeviceSummary(
+            unit=row["unit"],
+            item_type=row["type__name"],
+            item_count=row["item_count"],
+            retrieved=row["retrieved"],
+            built=built,
+        )
+        for row in aggregate_device_counts()
+    ]
+    with transaction.atomic():
+        DeviceSummary.objects.all().delete()
+        DeviceSummary.objects.bulk_create(rows)
+        # If called within a larger transaction (like the admin does), wait
+        # until the new summary is visible to other processes.
+        transaction.on_commit(refresh_devices_cache)
+    return len(rows)
+
+
+def snapshot_device_counts() -> int:
+    """Save the current device summary as a snapshot, for /devices/history/.
+
+    :return: The number of snapshot rows written.
+    """
+    taken = timezone.now()
+    return len(
+        DeviceCountSnapshot.objects.bulk_create(
+            DeviceCountSnapshot(
+                unit=row.unit,
+                item_type=row.item_type,
+                item_count=row.item_count,
+                taken=taken,
+            )
+            for row in DeviceSummary.objects.all()
+        )
+    )
+
+
+def build_devices_payload(
+    unit: str | None = None, item_type: str | None = None, flat: bool = False
+) -> dict:
+    """Serialize the device summary for the /devices/ endpoint.
+
+    Counts are grouped by unit, then by item type, or with flat, listed as
+    {"unit", "item_type", "item_count"} objects. Filters are applied in the query.
+    The ETag is a hash of the serialized body, so it only changes when the data does.
+
+    :param unit: Only this unit, or None for all.
+    :param item_type: Only this item type, or None for all.
+    :param flat: Whether to return a flat list instead of nested dictionaries.
+    :return: Dictionary with the JSON body (bytes), its compressed variants
+        ({encoding: bytes}, see compress_variants), ETag and Last-Modified (epoch
+        seconds, or None if there are no matching rows).
+    """
+    summary = DeviceSummary.objects.order_by("unit", "item_type")
+    if unit is not None:
+        summary = summary.filter(unit=unit)
+    if item_type is not None:
+        summary = summary.filter(item_type=item_type)
+    rows = summary.values_list("unit", "item_type", "item_count", "built")
+
+    built = None
+    if flat:
+        data = []
+        for row_unit, row_type, item_count, built in rows:
+            data.append(
+                {"unit": row_unit, "item_type": row_type, "item_count": item_count}
+            )
+    else:
+        data = {}
+        for row_unit, row_type, item_count, built in rows:
+            # All rows come from the same rebuild.
+            data.setdefault(row_unit, {})[row_type] = item_count
+
+    body = json.dumps(data).encode()
+    return {
+        "body": body,
+        # Compressed once here, rather than for each response.
+        "encodings": compress_variants(body, settings.COMPRESSION_MIN_BYTES),
+        "etag": quote_etag(hashlib.md5(body).hexdigest()),
+        "last_modified": int(built.timestamp()) if built else None,
+    }
+
+
+def get_devices_payload(
+    unit: str | None = None, item_type: str | None = None, flat: bool = False
+) -> tuple[dict, bool]:
+    """Get the serialized /devices/ payload, from the shared cache if possible.
+
+    Each combination of filters and format is cached separately, under the
+    current generation, so a rebuild makes them all stale at once. The full,
+    nested payload is stored by refresh_devices_cache() for each generation;
+    others expire after DEVICES_VARIANT_TIMEOUT. Filters matching
+    nothing, like an unknown unit, aren't cached, so arbitrary query
+    parameters can't fill the cache.
+
+    :param unit: Only this unit, or None for all.
+    :param item_type: Only this item type, or None for all.
+    :param flat: Whether to return a flat list instead of nested dictionaries.
+    :return: Tuple of the payload (see build_devices_payload) and whether
+        it came from the cache.
+    """
+    cache = caches[DEVICES_CACHE]
+    # Read the generation before building, so a payload built from an older
+    # summary can only be stored under an older generation. The generation is
+    # only incremented once the new summary is committed, so every payload
+    # stored under the current generation is built from it.
+    generation = caches[DEVICES_STATE_CACHE].get(DEVICES_GENERATION_KEY, 0)
+    if unit is None and item_type is None and not flat:
+        key, timeout = _full_payload_key(generation), None
+    else:
+        variant = json.dumps([unit, item_type, flat]).encode()
+        # Hashed, as units and item types can contain characters not allowed in keys.
+        key = f"{DEVICES_PAYLOAD_KEY}:{generation}:{hashlib.md5(variant).hexdigest()}"
+        timeout = DEVICES_VARIANT_TIMEOUT
+    payload = cache.get(key)
+    if payload is not None:
+        metrics.increment(DEVICES_CACHE_METRIC, result="hit")
+        return payload, True
+
+    metrics.increment(DEVICES_CACHE_METRIC, result="miss")
+    payload = build_devices_payload(unit, item_type, flat)
+    if timeout is None or payload["last_modified"] is not None:
+        # add() isn't atomic on the file-based cache, so another process may
+        # store the same key at once; either way, it's built from the same summary.
+        cache.add(key, payload, timeout=timeout)
+    return payload, False
+
+
+def refresh_devices_cache() -> None:
+    """Start a new generation of cached /devices/ payloads, with the full payload
+    built from the current summary, and publish the static export.
+
+    :return: None
+    """
+    payload = build_devices_payload()
+    state_cache = caches[DEVICES_STATE_CACHE]
+    state_cache.add(DEVICES_GENERATION_KEY, 0, timeout=None)
+    generation = state_cache.incr(DEVICES_GENERATION_KEY)
+    cache = caches[DEVICES_CACHE]
+    cache.set(_full_payload_key(generation), payload, timeout=None)
+    # Others from the previous generation expire by themselves.
+    cache.delete(_full_payload_key(generation - 1))
+    try:
+        export_devices(payload["body"])
+    except OSError:
+        # The API still has the new data; the export catches up on the next rebuild.
+        logger.exception("Failed to export /devices/ data.")
+
+
+def _full_payload_key(generation: int) -> str:
+    return f"{DEVICES_PAYLOAD_KEY}:{generation}"
+
+
+def lookup_barcodes(barcodes: list[str]) -> dict[str, list[dict]]:
+    """Find the sets containing each barcode, in one query using the barcode index.
+
+    A barcode can be in more than one set, so each has a list of matches.
+
+    :param barcodes: Barcodes to look up.
+    :return: Dictionary of {barcode: [{"set", "alma_set_id", "unit", "item_type"}]},
+        with only the barcodes which were found.
+    """
+    matches = {}
+    items = (
+        Item.objects.filter(barcode__in=set(barcodes))
+        .values_list(
+            "barcode", "set__name", "set__alma_set_id", "set__unit", "set__type__name"
+        )
+        .order_by("barcode", "set__name")
+    )
+    for barcode, set_name, alma_set_id, unit, item_type in items:
+        matches.setdefault(barcode, []).append(
+            {
+                "set": set_name,
+                "alma_set_id": alma_set_id,
+                "unit": unit,
+                "item_type": item_type,
+            }
+        )
+    return matches
+
+
+def devices_cache_totals() -> dict:
+    """Get /devices/ cache hit and miss counts across all processes,
+    including this one's unsaved counts.
+
+    :return: Dictionary of {"hits": count, "misses": count}.
+    """
+    metrics.flush()
+    counts = dict(
+        MetricSample.objects.filter(name=DEVICES_CACHE_METRIC).values_list(
+            "labels", "value"
+        )
+    )
+    hits = counts.get(format_labels({"result": "hit"}), 0)
+    misses = counts.get(format_labels({"result": "miss"}), 0)
+    return {"hits": int(hits), "misses": int(misses)}
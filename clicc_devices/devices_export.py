@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import os
+import re
+from django.conf import settings
+from clicc_devices.compression import compress_variants
+from clicc_devices.file_utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Static export of the /devices/ payload, served by DevicesExportMiddleware.
+# Each version is saved as devices.<hash>.json, named after its content so
+# it can be cached forever, with gzip and brotli variants. devices.json
+# redirects to the current version, named in the pointer file.
+EXPORT_NAME = "devices.json"
+VERSIONED_EXPORT_NAME = re.compile(r"devices\.[0-9a-f]{12}\.json")
+EXPORT_POINTER = "devices.latest"
+# Older versions kept, for clients which followed an earlier redirect.
+EXPORT_VERSIONS_KEPT = 5
+# File suffixes of compressed variants, by content coding, as WhiteNoise expects.
+VARIANT_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+
+def export_devices(body: bytes, directory: str | None = None) -> str:
+    """Publish a /devices/ payload as static files, each written atomically.
+
+    Variants are written before the versioned file, and the pointer last, so
+    a version is never served before all of its files are complete.
+
+    :param body: Serialized /devices/ JSON.
+    :param directory: Directory to write to; default settings.DEVICES_EXPORT_DIR.
+    :return: Name of the versioned file, like devices.0123456789ab.json.
+    """
+    directory = directory or settings.DEVICES_EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"devices.{hashlib.md5(body).hexdigest()[:12]}.json"
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        # Same content as an earlier version: mark it as recent, so it's kept.
+        os.utime(path)
+    else:
+        for encoding, compressed in compress_variants(body).items():
+            write_atomic(path + VARIANT_SUFFIXES[encoding], compressed)
+        write_atomic(path, body)
+    write_atomic(os.path.join(directory, EXPORT_POINTER), name.encode())
+    _remove_old_versions(directory)
+    return name
+
+
+def current_export_name(directory: str | None = None) -> str | None:
+    """Get the name of the current version of the export.
+
+    :param directory: Export directory; default settings.DEVICES_EXPORT_DIR.
+    :return: Name like devices.0123456789ab.json, or None if nothing
+        has been exported yet.
+    """
+    directory = directory or settings.DEVICES_EXPORT_DIR
+    try:
+        with open(os.path.join(directory, EXPORT_POINTER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return name if VERSIONED_EXPORT_NAME.fullmatch(name) else None
+
+
+def _remove_old_versions(directory: str) -> None:
+    versions = sorted(
+        (
+            entry
+            for entry in os.scandir(directory)
+            if VERSIONED_EXPORT_NAME.fullmatch(entry.name)
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in versions[EXPORT_VERSIONS_KEPT:]:
+        for suffix in ["", *VARIANT_SUFFIXES.values()]:
+            try:
+                os.remove(entry.path + suffix)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Removed old devices export {entry.name}.")
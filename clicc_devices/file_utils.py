@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write a file so readers see either the old file or the complete new one.
+
+    Data is written to a unique temporary file in the same directory, then
+    renamed over the target, so concurrent writers never share a temporary
+    file, and a failed write never leaves a partial file.
+
+    :param path: Path of the file to write.
+    :param data: Contents of the file.
+    :return: None
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp() creates files readable only by their owner.
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,62 @@
+import fcntl
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+
+
+class MultiProcessRotatingFileHandler(RotatingFileHandler):
+    """A RotatingFileHandler for a log file shared by several processes.
+
+    All gunicorn workers, and the cron-launched retrieve_sets command, write
+    to the same log file. The standard handler only knows about what its own
+    process has written, so each process would rotate the file on its own.
+    This handler instead:
+    * decides when to rotate from the size of the file on disk,
+    * rotates while holding an exclusive lock, so only one process rotates, and
+    * reopens its file when another process has rotated it.
+    """
+
+    def __init__(self, filename: str, *args, **kwargs) -> None:
+        super().__init__(filename, *args, **kwargs)
+        self.lock_filename = f"{self.baseFilename}.lock"
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.stream and self._rotated_elsewhere():
+                self.stream.close()
+                self.stream = self._open()
+        except Exception:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.maxBytes <= 0:
+            return False
+        try:
+            size = os.path.getsize(self.baseFilename)
+        except FileNotFoundError:
+            return False
+        return size + len(self.format(record)) + 1 >= self.maxBytes
+
+    def doRollover(self) -> None:
+        with open(self.lock_filename, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self.stream and self._rotated_elsewhere():
+                    # Another process rotated the file while this one waited.
+                    self.stream.close()
+                    self.stream = self._open()
+                else:
+                    super().doRollover()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rotated_elsewhere(self) -> bool:
+        # True if the file at baseFilename is no longer the one this handler has open.
+        try:
+            on_disk = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        in_use = os.fstat(self.stream.fileno())
+        return (on_disk.st_dev, on_disk.st_ino) != (in_use.st_dev, in_use.st_ino)
@@ -0,0 +1,201 @@
+import bisect
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from typing import BinaryIO
+from clicc_devices.file_utils import write_atomic
+
+# Start of each log record, from the "verbose" formatter in settings.LOGGING:
+# level, then date and time (to the second) in local time.
+RECORD_START = re.compile(
+    rb"^(DEBUG|INFO|WARNING|ERROR|CRITICAL) (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)"
+)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Approximate bytes between index checkpoints.
+CHECKPOINT_BYTES = 64 * 1024
+# Bytes at the start of a file used to check that an index still belongs to it.
+HEAD_BYTES = 64
+
+
+def log_files(log_file: str) -> list[str]:
+    """Get the log file and its rotated backups, oldest first.
+
+    :param log_file: Path to the current log file.
+    :return: List of paths: log_file.N, ..., log_file.1, log_file.
+    """
+    directory, name = os.path.split(log_file)
+    backup = re.compile(rf"^{re.escape(name)}\.(\d+)$")
+    backups = []
+    for entry in os.listdir(directory):
+        if match := backup.match(entry):
+            backups.append((int(match.group(1)), os.path.join(directory, entry)))
+    paths = [path for _, path in sorted(backups, reverse=True)]
+    if os.path.exists(log_file):
+        paths.append(log_file)
+    return paths
+
+
+def get_log_index(path: str, index_dir: str) -> dict:
+    """Get the index for a log file, first indexing anything new in the file.
+
+    The index lists checkpoints: the timestamp and byte offset of the first record
+    after every CHECKPOINT_BYTES. It's saved in index_dir, named by inode, so it
+    stays valid when the file is renamed by rotation, and only new data is read
+    when the file grows.
+
+    :param path: Path to the log file.
+    :param index_dir: Directory for saved indexes.
+    :return: Dictionary with "checkpoints" ([[timestamp, offset], ...]),
+        "indexed_to" (offset after the last complete line indexed),
+        "last_timestamp" and "head".
+    """
+    index_path = os.path.join(index_dir, f"{os.stat(path).st_ino}.json")
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = None
+
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        head = f.read(HEAD_BYTES).hex()
+        # An inode can be reused by a new file, which won't match the saved index.
+        if index is None or index["head"] != head or index["indexed_to"] > size:
+            index = {
+                "checkpoints": [],
+                "indexed_to": 0,
+                "last_timestamp": None,
+                "head": head,
+            }
+        if index["indexed_to"] < size:
+            _extend_index(f, index)
+            os.makedirs(index_dir, exist_ok=True)
+            # Other processes never read a partial index.
+            write_atomic(index_path, json.dumps(index).encode())
+    return index
+
+
+def remove_stale_indexes(log_file: str, index_dir: str) -> None:
+    """Delete saved indexes for log files which no longer exist.
+
+    :param log_file: Path to the current log file.
+    :param index_dir: Directory for saved indexes.
+    :return: None
+    """
+    if not os.path.isdir(index_dir):
+        return
+    current = {f"{os.stat(path).st_ino}.json" for path in log_files(log_file)}
+    for entry in os.listdir(index_dir):
+        if entry.endswith(".json") and entry not in current:
+            os.remove(os.path.join(index_dir, entry))
+
+
+def filter_log_records(
+    log_file: str,
+    index_dir: str,
+    level: str | None = None,
+    since: datetime | None = None,
+    limit: int = 200,
+) -> list[str]:
+    """Get log records at or above a level, and at or after a time,
+    from the log file and its rotated backups.
+
+    With since, reading starts at the last checkpoint before that time, and
+    the earliest matching records are returned. Without it, the log is read
+    backwards one checkpoint at a time, and the most recent matching records
+    are returned.
+
+    :param log_file: Path to the current log file.
+    :param index_dir: Directory for saved indexes.
+    :param level: Minimum level name, like "ERROR".
+    :param since: Earliest time, in the log's local time.
+    :param limit: Most records to return.
+    :return: List of records, oldest first. Records can have several lines,
+        like tracebacks.
+    """
+    min_level = logging.getLevelName(level) if level else logging.NOTSET
+    since_text = since.strftime(TIMESTAMP_FORMAT) if since else None
+
+    remove_stale_indexes(log_file, index_dir)
+    # Segments run from one checkpoint to the next, across all files, in order.
+    segments = []
+    for path in log_files(log_file):
+        index = get_log_index(path, index_dir)
+        if since_text and (index["last_timestamp"] or "") < since_text:
+            # Nothing in this file is recent enough.
+            continue
+        starts = [(timestamp, offset) for timestamp, offset in index["checkpoints"]]
+        if not starts or starts[0][1] > 0:
+            # Lines before the first record, which belong to the previous file.
+            previous = segments[-1][3] if segments else ""
+            starts.insert(0, (previous, 0))
+        ends = [offset for _, offset in starts[1:]] + [index["indexed_to"]]
+        for (timestamp, start), end in zip(starts, ends):
+            segments.append((path, start, end, timestamp))
+
+    def matches(record: tuple) -> bool:
+        record_level, timestamp, _ = record
+        return (
+            record_level is not None
+            and logging.getLevelName(record_level) >= min_level
+            and (since_text is None or timestamp >= since_text)
+        )
+
+    results = []
+    if since_text:
+        # Skip to the last segment starting before since.
+        timestamps = [timestamp for _, _, _, timestamp in segments]
+        first = max(bisect.bisect_left(timestamps, since_text) - 1, 0)
+        for path, start, end, _ in segments[first:]:
+            results.extend(r for r in _read_records(path, start, end) if matches(r))
+            if len(results) >= limit:
+                break
+        results = results[:limit]
+    else:
+        for path, start, end, _ in reversed(segments):
+            segment_results = [r for r in _read_records(path, start, end) if matches(r)]
+            results = segment_results + results
+            if len(results) >= limit:
+                break
+        results = results[-limit:]
+    return [text for _, _, text in results]
+
+
+def _extend_index(f: BinaryIO, index: dict) -> None:
+    checkpoints = index["checkpoints"]
+    offset = index["indexed_to"]
+    next_checkpoint = checkpoints[-1][1] + CHECKPOINT_BYTES if checkpoints else 0
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b"\n"):
+            # Still being written; index it next time.
+            break
+        if match := RECORD_START.match(line):
+            timestamp = match.group(2).decode()
+            if offset >= next_checkpoint:
+                checkpoints.append([timestamp, offset])
+                next_checkpoint = offset + CHECKPOINT_BYTES
+            index["last_timestamp"] = timestamp
+        offset += len(line)
+    index["indexed_to"] = offset
+
+
+def _read_records(path: str, start: int, end: int) -> list[tuple]:
+    # Get (level, timestamp, text) for each record between two offsets.
+    # Lines which don't start a record (like tracebacks) belong to the one before.
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    records = []
+    for line in data.splitlines(keepends=True):
+        text = line.decode("utf-8", errors="replace")
+        if match := RECORD_START.match(line):
+            records.append([match.group(1).decode(), match.group(2).decode(), text])
+        elif records:
+            records[-1][2] += text
+        else:
+            records.append([None, None, text])
+    return [tuple(record) for record in records]
@@ -0,0 +1,122 @@
+import os
+from typing import BinaryIO
+
+# Bytes read from the file at a time.
+DEFAULT_BLOCK_SIZE = 8192
+# Most bytes returned by one call to read_new_lines().
+DEFAULT_MAX_BYTES = 256 * 1024
+
+
+def tail_lines(
+    path: str, line_count: int, block_size: int = DEFAULT_BLOCK_SIZE
+) -> list[str]:
+    """Get the last lines of a file, reading backwards from the end in blocks.
+
+    The amount read depends on the number (and length) of lines requested,
+    not on the size of the file.
+
+    :param path: Path to the file.
+    :param line_count: Number of lines to return.
+    :param block_size: Bytes read at a time.
+    :return: List of up to line_count lines, oldest first, with line endings.
+    """
+    lines, _ = tail_lines_with_cursor(path, line_count, block_size)
+    return lines
+
+
+def tail_lines_with_cursor(
+    path: str, line_count: int, block_size: int = DEFAULT_BLOCK_SIZE
+) -> tuple[list[str], str]:
+    """Like tail_lines(), but also return a cursor for the end of the lines,
+    for use in read_new_lines().
+
+    :param path: Path to the file.
+    :param line_count: Number of lines to return.
+    :param block_size: Bytes read at a time.
+    :return: Tuple of the lines and the cursor.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        lines = _read_tail(f, end, line_count, block_size)
+        return lines, format_cursor(os.fstat(f.fileno()).st_ino, end)
+
+
+def read_new_lines(
+    path: str, cursor: str, max_bytes: int = DEFAULT_MAX_BYTES
+) -> tuple[list[str], str, bool]:
+    """Get complete lines written to a file after the cursor.
+
+    If the file has a different inode from the one in the cursor, it has been
+    rotated or replaced; if it's shorter than the cursor's offset, it has been
+    truncated. Either way, reading starts again from the beginning.
+
+    :param path: Path to the file.
+    :param cursor: Cursor returned by an earlier call, or by
+        tail_lines_with_cursor().
+    :param max_bytes: Most bytes to read; remaining lines are returned
+        by the next call.
+    :return: Tuple of the lines, the new cursor, and whether reading restarted
+        from the beginning of the file.
+    :raises ValueError: If the cursor isn't one returned by this module.
+    """
+    inode, offset = parse_cursor(cursor)
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        current_inode = os.fstat(f.fileno()).st_ino
+        reset = current_inode != inode or offset > size
+        if reset:
+            offset = 0
+        f.seek(offset)
+        data = f.read(max_bytes)
+    # Leave any incomplete last line for the next call, unless a single
+    # line fills the whole read.
+    complete = data.rfind(b"\n") + 1
+    if complete or len(data) < max_bytes:
+        data = data[:complete]
+    lines = data.splitlines(keepends=True)
+    return _decode(lines), format_cursor(current_inode, offset + len(data)), reset
+
+
+def format_cursor(inode: int, offset: int) -> str:
+    """Make a cursor for read_new_lines().
+
+    :param inode: Inode of the file, to tell when it has been replaced.
+    :param offset: Byte offset in the file to read from.
+    :return: Cursor like "1234:5678".
+    """
+    return f"{inode}:{offset}"
+
+
+def parse_cursor(cursor: str) -> tuple[int, int]:
+    """Get the inode and byte offset from a cursor made by format_cursor().
+
+    :param cursor: Cursor like "1234:5678".
+    :return: Tuple of the inode and offset.
+    :raises ValueError: If the cursor isn't in the expected format.
+    """
+    inode, separator, offset = cursor.partition(":")
+    if not (separator and inode.isdigit() and offset.isdigit()):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return int(inode), int(offset)
+
+
+def _read_tail(f: BinaryIO, end: int, line_count: int, block_size: int) -> list[str]:
+    if line_count < 1:
+        return []
+    blocks = []
+    newlines = 0
+    position = end
+    # One more newline than lines wanted means the first wanted line is complete.
+    while position > 0 and newlines <= line_count:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        block = f.read(read_size)
+        blocks.append(block)
+        newlines += block.count(b"\n")
+    data = b"".join(reversed(blocks))
+    return _decode(data.splitlines(keepends=True)[-line_count:])
+
+
+def _decode(lines: list[bytes]) -> list[str]:
+    return [line.decode("utf-8", errors="replace") for line in lines]
@@ -0,0 +1,172 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.test.runner import DiscoverRunner
+from django.utils import timezone
+from clicc_devices.benchmark import run_benchmark
+import argparse
+import django
+import json
+import platform
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure /devices/, the Sets page and retrieve_sets on synthetic data, "
+        "in a temporary test database"
+    )
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        """Add command line arguments for the management command.
+
+        :param parser: Argument parser instance to add arguments to.
+        :return: None
+        """
+        parser.add_argument(
+            "--sets",
+            type=int,
+            default=500,
+            help="Number of synthetic sets (default: 500)",
+        )
+        parser.add_argument(
+            "--items_per_set",
+            type=int,
+            default=5000,
+            help="Number of items in each set (default: 5000)",
+        )
+        parser.add_argument(
+            "--units",
+            type=int,
+            default=20,
+            help="Number of distinct units (default: 20)",
+        )
+        parser.add_argument(
+            "--types",
+            type=int,
+            default=10,
+            help="Number of distinct item types (default: 10)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of times each page is requested (default: 5)",
+        )
+        parser.add_argument(
+            "--churn",
+            type=float,
+            default=0.05,
+            help="Fraction of each set's items changed in the fake Alma client, "
+            "for retrieve_sets to add and remove (default: 0.05)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="--workers for retrieve_sets (default: 1)",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Run retrieve_sets with --stream",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Seconds each request to the fake Alma client takes, "
+            "for retrieve_sets (default: 0)",
+        )
+        parser.add_argument(
+            "--accept_encoding",
+            type=str,
+            default="gzip, br",
+            help="Accept-Encoding header for page requests; "
+            'use "" for uncompressed responses (default: "gzip, br")',
+        )
+        parser.add_argument(
+            "--output",
+            type=str,
+            help="File to write JSON results to (default: standard output)",
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Create a test database, run the benchmarks in it, then destroy it.
+
+        Results are written as JSON, with the parameters and environment,
+        so they can be compared across releases.
+        """
+        for option in ["sets", "items_per_set", "units", "types", "repeat"]:
+            if options[option] < 1:
+                raise CommandError(f"--{option} must be at least 1.")
+        if not 0 <= options["churn"] <= 1:
+            raise CommandError("--churn must be between 0 and 1.")
+        if (
+            options["workers"] > 1
+            and options["stream"]
+            and connection.vendor != "postgresql"
+        ):
+            # Streaming workers write to the staging table concurrently, which
+            # SQLite's in-memory test database can't do.
+            raise CommandError("--workers with --stream requires PostgreSQL.")
+
+        parameters = {
+            option: options[option]
+            for option in [
+                "sets",
+                "items_per_set",
+                "units",
+                "types",
+                "repeat",
+                "churn",
+                "workers",
+                "stream",
+                "latency",
+                "accept_encoding",
+            ]
+        }
+        started = timezone.now()
+        # Same database setup as manage.py test, so real data is never touched.
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = run_benchmark(
+                set_count=options["sets"],
+                items_per_set=options["items_per_set"],
+                units=options["units"],
+                types=options["types"],
+                repeat=options["repeat"],
+                churn=options["churn"],
+                retrieve_options={
+                    "workers": options["workers"],
+                    "stream": options["stream"],
+                    "latency": options["latency"],
+                },
+                accept_encoding=options["accept_encoding"],
+            )
+            version = ".".join(str(part) for part in connection.get_database_version())
+            database = f"{connection.vendor} {version}"
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        report = {
+            "started": started.isoformat(),
+            "parameters": parameters,
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": database,
+                "debug": settings.DEBUG,
+            },
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stdout.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
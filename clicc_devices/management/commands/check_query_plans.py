@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from clicc_devices.query_plans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = "Check that the application's main queries use indexes."
+
+    def handle(self, *args, **options) -> None:
+        """Show whether each main query uses an index, with plans at verbosity 2+.
+
+        Raises CommandError if any query doesn't use an index, so this can
+        be used in CI or after migrations. Databases whose plans can't be
+        checked are skipped, with a warning.
+        """
+        plans, failures = check_query_plans()
+        if not plans:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"SKIPPED: query plans can't be checked on {connection.vendor}."
+                )
+            )
+            return
+        for description, plan in plans.items():
+            status = "NO INDEX" if description in failures else "OK"
+            self.stdout.write(f"{status}: {description}")
+            if options["verbosity"] >= 2:
+                self.stdout.write(plan)
+        if failures:
+            raise CommandError(f"{len(failures)} query(ies) don't use an index.")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from clicc_devices.device_data import build_devices_payload
+from clicc_devices.devices_export import export_devices
+
+
+class Command(BaseCommand):
+    help = "Publish the static export of /devices/ from the current device summary."
+
+    def handle(self, *args, **options) -> None:
+        """Write the export, as retrieve_sets does after rebuilding the summary.
+
+        Run when the container starts, so a fresh deploy serves the export
+        before retrieve_sets next runs.
+        """
+        name = export_devices(build_devices_payload()["body"])
+        self.stdout.write(f"Exported /devices/ data as {name}.")
@@ -1,10 +1,32 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 from django.conf import settings
-from clicc_devices.models import Set, Item
+from django.db import connections
+from django.utils import timezone
+from clicc_devices.alma import AlmaRequestError, AlmaSetMembersClient, MAX_PAGE_SIZE
+from clicc_devices.alma_offline import (
+    FakeAlmaClient,
+    RecordingAlmaClient,
+    ReplayAlmaClient,
+)
+from clicc_devices.device_data import rebuild_device_summary, snapshot_device_counts
+from clicc_devices.devices_export import current_export_name
+from clicc_devices.metrics import metrics
+from clicc_devices.models import RetrievalRun, Set, SetRetrieval
+from clicc_devices.retrieval import (
+    DEFAULT_BATCH_SIZE,
+    RateLimiter,
+    apply_staged_items,
+    copy_supported,
+    run_concurrently,
+    stage_set_items,
+    sync_set_items,
+)
 import logging
 import argparse
-from alma_api_client import AlmaAPIClient, APIError
+import resource
+import threading
+import time
+import tracemalloc
 
 
 class Command(BaseCommand):
@@ -22,6 +44,116 @@ class Command(BaseCommand):
             help="Retrieve a specific set by Alma set ID",
             required=False,
         )
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f"Number of items per database INSERT (default: {DEFAULT_BATCH_SIZE})",
+            required=False,
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of sets to retrieve from Alma concurrently (default: 1)",
+            required=False,
+        )
+        parser.add_argument(
+            "--max_requests_per_second",
+            type=float,
+            default=settings.ALMA_MAX_REQUESTS_PER_SECOND,
+            help="Maximum rate of requests to Alma, across all workers "
+            f"(default: {settings.ALMA_MAX_REQUESTS_PER_SECOND})",
+            required=False,
+        )
+
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Read set members from Alma page by page, writing each page to the "
+            "database as it arrives, so memory use doesn't grow with set size",
+            required=False,
+        )
+        parser.add_argument(
+            "--page_size",
+            type=int,
+            default=MAX_PAGE_SIZE,
+            help="Set members per Alma request, or per simulated request "
+            f"with --client fake or replay (default: {MAX_PAGE_SIZE})",
+            required=False,
+        )
+        parser.add_argument(
+            "--changed_only",
+            action="store_true",
+            help="Skip sets whose Alma metadata (member count, status date, query) "
+            "is unchanged since they were last retrieved",
+            required=False,
+        )
+        parser.add_argument(
+            "--loader",
+            choices=["auto", "copy", "orm"],
+            default="auto",
+            help="How items are loaded into the staging table: PostgreSQL COPY, or "
+            "batched ORM inserts. auto uses COPY for --stream when the database "
+            "supports it; copy also stages sets retrieved without --stream "
+            "(default: auto)",
+            required=False,
+        )
+        parser.add_argument(
+            "--client",
+            choices=["live", "record", "replay", "fake"],
+            default="live",
+            help="Where sets come from: live reads from Alma; record also saves "
+            "them in --recording_dir; replay serves sets saved by record; fake "
+            "generates synthetic sets. replay and fake need no network access "
+            "or API key (default: live)",
+            required=False,
+        )
+        parser.add_argument(
+            "--recording_dir",
+            type=str,
+            default=settings.ALMA_RECORDING_DIR,
+            help="Directory for --client record and replay "
+            f"(default: {settings.ALMA_RECORDING_DIR})",
+            required=False,
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Seconds each simulated Alma request takes, with --client fake "
+            "or replay (default: 0)",
+            required=False,
+        )
+        parser.add_argument(
+            "--error_rate",
+            type=float,
+            default=0,
+            help="Fraction of simulated Alma requests which fail, with --client "
+            "fake or replay (default: 0)",
+            required=False,
+        )
+        parser.add_argument(
+            "--fake_items_per_set",
+            type=int,
+            default=1000,
+            help="Members in each set with --client fake (default: 1000)",
+            required=False,
+        )
+        parser.add_argument(
+            "--fake_churn",
+            type=float,
+            default=0,
+            help="Fraction of each set's members which change between runs, "
+            "with --client fake (default: 0)",
+            required=False,
+        )
+        parser.add_argument(
+            "--report_memory",
+            action="store_true",
+            help="Log peak memory used while processing each set, and overall",
+            required=False,
+        )
 
     def handle(self, *args, **options) -> None:
 
@@ -31,11 +163,131 @@ class Command(BaseCommand):
         logging.getLogger("urllib3").setLevel(logging.INFO)
 
         set_id = options.get("set_id")
+        batch_size = options.get("batch_size")
+        if batch_size < 1:
+            logger.error("--batch_size must be at least 1.")
+            return
+        if options.get("page_size") < 1:
+            logger.error("--page_size must be at least 1.")
+            return
+        workers = options.get("workers")
+        if workers < 1:
+            logger.error("--workers must be at least 1.")
+            return
+        client_mode = options.get("client")
+        recording_dir = options.get("recording_dir")
+        if not 0 <= options.get("error_rate") <= 1:
+            logger.error("--error_rate must be between 0 and 1.")
+            return
         api_key = settings.ALMA_API_KEY
-        if not api_key:
+        if not api_key and client_mode in ["live", "record"]:
             logger.error("ALMA_API_KEY environment variable is not set.")
             return
-        alma_client = AlmaAPIClient(api_key)
+        stream = options.get("stream")
+        changed_only = options.get("changed_only")
+        page_size = options.get("page_size")
+        report_memory = options.get("report_memory")
+        loader = options.get("loader")
+        if loader == "copy" and not copy_supported():
+            logger.error("--loader copy requires a PostgreSQL database.")
+            return
+        use_copy = loader == "copy" or (loader == "auto" and copy_supported())
+        rate_limiter = RateLimiter(options.get("max_requests_per_second"))
+        # Each worker thread gets its own client, so no HTTP session is shared.
+        thread_data = threading.local()
+        offline_options = {
+            "latency": options.get("latency"),
+            "page_size": page_size,
+            "error_rate": options.get("error_rate"),
+        }
+        # Offline clients have no sessions, so all threads share one.
+        if client_mode == "fake":
+            offline_client = FakeAlmaClient(
+                items_per_set=options.get("fake_items_per_set"),
+                churn=options.get("fake_churn"),
+                # Earlier runs are counted, so each run changes different members.
+                run=RetrievalRun.objects.count(),
+                **offline_options,
+            )
+        elif client_mode == "replay":
+            offline_client = ReplayAlmaClient(recording_dir, **offline_options)
+
+        def get_alma_client() -> AlmaSetMembersClient:
+            if client_mode in ["fake", "replay"]:
+                return offline_client
+            if not hasattr(thread_data, "alma_client"):
+                # The rate limit applies to each request made by this client,
+                # including each page of a set's members.
+                thread_data.alma_client = AlmaSetMembersClient(
+                    api_key, rate_limiter=rate_limiter
+                )
+                if client_mode == "record":
+                    thread_data.alma_client = RecordingAlmaClient(
+                        thread_data.alma_client, recording_dir
+                    )
+            return thread_data.alma_client
+
+        def retrieve_set(set_obj: Set) -> dict:
+            """Retrieve a set from Alma; runs in a worker thread.
+
+            With --stream, members are written to the staging table as they arrive.
+            With --changed_only, sets whose fingerprint hasn't changed are skipped.
+
+            :param set_obj: The Set to retrieve.
+            :return: Dictionary with "alma_set" (None if streamed, skipped or failed),
+                "error" (None on success), "fingerprint" (None unless --changed_only),
+                "skipped", "started", and "fetch_seconds" (None if skipped or failed).
+            """
+            retrieval = {
+                "alma_set": None,
+                "error": None,
+                "fingerprint": None,
+                "skipped": False,
+                "started": timezone.now(),
+                "fetch_seconds": None,
+            }
+            logger.info(
+                f"Starting retrieval of set: {set_obj.name} (Alma ID: {set_obj.alma_set_id})"
+            )
+            start = time.perf_counter()
+            try:
+                if changed_only:
+                    # Get the fingerprint before the members, so if the set changes
+                    # in between, the next run will retrieve it again.
+                    fingerprint = get_alma_client().get_set_fingerprint(
+                        set_obj.alma_set_id
+                    )
+                    retrieval["fingerprint"] = fingerprint
+                    if fingerprint == set_obj.alma_fingerprint:
+                        retrieval["skipped"] = True
+                        return retrieval
+                if stream:
+                    pages = get_alma_client().iter_member_pages(
+                        set_obj.alma_set_id, page_size=page_size
+                    )
+                    staged = stage_set_items(
+                        set_obj, pages, batch_size=batch_size, use_copy=use_copy
+                    )
+                    logger.info(f"Streamed {staged} member(s) to staging.")
+                else:
+                    retrieval["alma_set"] = get_alma_client().get_set(
+                        set_obj.alma_set_id, page_size=page_size
+                    )
+            except AlmaRequestError as e:
+                retrieval["error"] = e
+                return retrieval
+            finally:
+                # Worker threads have their own database connections; don't leave
+                # them open. With 1 worker, this is the main thread's connection.
+                if workers > 1:
+                    connections.close_all()
+            retrieval["fetch_seconds"] = time.perf_counter() - start
+            logger.info(
+                f"Retrieved set from Alma: {set_obj.name} "
+                f"(Alma ID: {set_obj.alma_set_id}) "
+                f"in {retrieval['fetch_seconds']:.2f} seconds."
+            )
+            return retrieval
 
         if set_id:
             # Check if the set with the given Alma ID exists in the database
@@ -46,43 +298,196 @@ class Command(BaseCommand):
                 return
             sets_to_process = [Set.objects.get(alma_set_id=set_id)]
         else:
-            sets_to_process = Set.objects.all()
+            sets_to_process = list(Set.objects.all())
 
-        logger.info(f"Starting retrieval of {len(sets_to_process)} set(s) from Alma.")
-        for set_obj in sets_to_process:
-            logger.info(
-                f"Starting retrieval of set: {set_obj.name} (Alma ID: {set_obj.alma_set_id})"
+        logger.info(
+            f"Starting retrieval of {len(sets_to_process)} set(s) from Alma, "
+            f"using {workers} worker(s)."
+        )
+        run_start = time.perf_counter()
+        # History of this run and each set in it, for the retrieval dashboard.
+        run = RetrievalRun.objects.create(
+            started=timezone.now(),
+            options=" ".join(
+                [
+                    f"--workers {workers}",
+                    f"--client {client_mode}",
+                    f"--loader {loader}",
+                ]
+                + [f"--{flag}" for flag in ["stream", "changed_only"] if options[flag]]
+                + ([f"--set_id {set_id}"] if set_id else [])
+            ),
+        )
+
+        def record_set(set_obj: Set, retrieval: dict, result: str, **fields) -> None:
+            SetRetrieval.objects.create(
+                run=run,
+                set=set_obj,
+                alma_set_id=set_obj.alma_set_id,
+                name=set_obj.name,
+                started=retrieval["started"],
+                result=result,
+                alma_seconds=retrieval["fetch_seconds"],
+                **fields,
             )
 
-            # Retrieve set from Alma
-            try:
-                alma_set = alma_client.get_set(set_obj.alma_set_id)
-            except APIError as e:
+        if report_memory:
+            tracemalloc.start()
+            peak_memory = 0
+        total_items = 0
+        total_write_time = 0.0
+        # Sets are fetched from Alma by worker threads. Apart from staging
+        # streamed pages, all database writes happen here, in the main thread,
+        # as each fetch completes.
+        synced_sets = 0
+        for set_obj, retrieval in run_concurrently(
+            retrieve_set, sets_to_process, workers
+        ):
+            if retrieval["error"]:
                 logger.error(
                     f"Failed to retrieve Alma set with Alma ID {set_obj.alma_set_id}: "
-                    f"{e.error_messages}",
+                    f"{retrieval['error'].error_messages}",
+                )
+                metrics.increment("clicc_devices_sets_retrieved_total", result="failed")
+                run.sets_failed += 1
+                record_set(
+                    set_obj,
+                    retrieval,
+                    "failed",
+                    error="; ".join(
+                        str(message) for message in retrieval["error"].error_messages
+                    ),
                 )
                 continue
-
-            # Remove existing items associated with the set
-            Item.objects.filter(set=set_obj).delete()
-
-            # Iterate through the members of the Alma set,
-            # and create Item objects for each member
-            for alma_item in alma_set.members:
-                Item.objects.create(
-                    set=set_obj,
-                    barcode=alma_item.description,
+            if retrieval["skipped"]:
+                logger.info(
+                    f"Skipped set: {set_obj.name} (Alma ID: {set_obj.alma_set_id}), "
+                    "unchanged since last retrieval."
                 )
+                metrics.increment(
+                    "clicc_devices_sets_retrieved_total", result="skipped"
+                )
+                run.sets_skipped += 1
+                record_set(set_obj, retrieval, "skipped")
+                continue
 
-            # Update the retrieved date/time for the set
-            set_obj.retrieved = timezone.now()
-            set_obj.save()
-
-            num_items = Item.objects.filter(set=set_obj).count()
+            # Update the set's items to match the current members, in a single
+            # transaction, writing only the differences, batch_size items at a time.
+            start = time.perf_counter()
+            if stream:
+                changes = apply_staged_items(set_obj)
+            elif loader == "copy":
+                # Load the whole set through the staging table with COPY, then
+                # apply the differences in one transaction.
+                stage_set_items(
+                    set_obj,
+                    [
+                        [
+                            alma_item.description
+                            for alma_item in retrieval["alma_set"].members
+                        ]
+                    ],
+                    use_copy=True,
+                )
+                changes = apply_staged_items(set_obj)
+            else:
+                changes = sync_set_items(
+                    set_obj,
+                    (
+                        alma_item.description
+                        for alma_item in retrieval["alma_set"].members
+                    ),
+                    batch_size=batch_size,
+                )
+            elapsed = time.perf_counter() - start
+            synced_sets += 1
+            if retrieval["fingerprint"]:
+                set_obj.alma_fingerprint = retrieval["fingerprint"]
+                set_obj.save(update_fields=["alma_fingerprint"])
+            num_items = changes["added"] + changes["unchanged"]
+            total_items += num_items
+            total_write_time += elapsed
+            metrics.increment("clicc_devices_sets_retrieved_total", result="synced")
+            record_set(set_obj, retrieval, "synced", write_seconds=elapsed, **changes)
+            metrics.observe(
+                "clicc_devices_set_fetch_duration_seconds", retrieval["fetch_seconds"]
+            )
+            metrics.observe("clicc_devices_set_sync_duration_seconds", elapsed)
+            metrics.increment("clicc_devices_items_synced_total", num_items)
+            for change in ["added", "removed"]:
+                metrics.increment(
+                    "clicc_devices_item_changes_total", changes[change], change=change
+                )
             logger.info(
                 f"Finished retrieval of set: {set_obj.name} "
                 f"(Alma ID: {set_obj.alma_set_id}). "
-                f"Items retrieved: {num_items}."
+                f"Items retrieved: {num_items} "
+                f"(added: {changes['added']}, removed: {changes['removed']}, "
+                f"unchanged: {changes['unchanged']}). "
+                f"Synced in {elapsed:.2f} seconds "
+                f"({num_items / elapsed if elapsed else 0:.0f} items/second)."
+            )
+            if report_memory:
+                _, set_peak = tracemalloc.get_traced_memory()
+                peak_memory = max(peak_memory, set_peak)
+                tracemalloc.reset_peak()
+                logger.info(
+                    f"Peak memory for set {set_obj.alma_set_id}: "
+                    f"{set_peak / 1024 / 1024:.1f} MiB."
+                )
+
+        if total_write_time:
+            logger.info(
+                f"Synced {total_items} item(s) in {total_write_time:.2f} seconds "
+                f"({total_items / total_write_time:.0f} items/second)."
             )
+
+        if report_memory:
+            tracemalloc.stop()
+            # On Linux, ru_maxrss is in KiB.
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            logger.info(
+                f"Peak memory traced while processing sets: "
+                f"{peak_memory / 1024 / 1024:.1f} MiB. "
+                f"Maximum resident set size of this process: {max_rss / 1024:.1f} MiB."
+            )
+
+        # Refresh the pre-aggregated counts used by the /devices/ endpoint,
+        # and its static export, unless no set was changed and there is
+        # already an export (which a new deployment might not have).
+        if synced_sets or current_export_name() is None:
+            summary_rows = rebuild_device_summary()
+            logger.info(
+                f"Device summary, /devices/ cache and export rebuilt "
+                f"with {summary_rows} row(s)."
+            )
+        # Keep a history of the counts, one snapshot per run, even if nothing
+        # changed, so every run is a point in the history.
+        snapshot_rows = snapshot_device_counts()
+        logger.info(f"Device count snapshot saved with {snapshot_rows} row(s).")
+
+        run.sets_synced = synced_sets
+        run.finished = timezone.now()
+        run.save()
+
+        # Run totals for /metrics/. This process is about to exit, so save them now.
+        metrics.increment("clicc_devices_retrieval_runs_total")
+        metrics.set(
+            "clicc_devices_retrieval_last_completed_timestamp_seconds", time.time()
+        )
+        metrics.set(
+            "clicc_devices_retrieval_last_duration_seconds",
+            time.perf_counter() - run_start,
+        )
+        if total_write_time:
+            metrics.set(
+                "clicc_devices_retrieval_last_items_per_second",
+                total_items / total_write_time,
+            )
+        # On Linux, ru_maxrss is in KiB.
+        metrics.set(
+            "clicc_devices_retrieval_last_max_rss_bytes",
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        )
+        metrics.flush()
         logger.info("Set retrieval process completed.")
@@ -0,0 +1,259 @@
+from collections import Counter
+import logging
+import re
+import threading
+import time
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from clicc_devices.models import MetricSample
+
+logger = logging.getLogger(__name__)
+
+# Metric families exposed by /metrics/: name: (type, help, histogram buckets).
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LONG_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+METRICS = {
+    "clicc_devices_http_requests_total": (
+        "counter",
+        "HTTP requests, by view and status code.",
+        None,
+    ),
+    "clicc_devices_http_request_duration_seconds": (
+        "histogram",
+        "Time taken to respond to HTTP requests, by view.",
+        DURATION_BUCKETS,
+    ),
+    "clicc_devices_devices_cache_requests_total": (
+        "counter",
+        "Requests for /devices/ data, by shared cache result: hit or miss.",
+        None,
+    ),
+    "clicc_devices_alma_request_duration_seconds": (
+        "histogram",
+        "Time taken by each request to the Alma API for set members.",
+        DURATION_BUCKETS,
+    ),
+    "clicc_devices_set_fetch_duration_seconds": (
+        "histogram",
+        "Time taken to retrieve each set from Alma, including staging with --stream.",
+        LONG_DURATION_BUCKETS,
+    ),
+    "clicc_devices_set_sync_duration_seconds": (
+        "histogram",
+        "Time taken to write each retrieved set's items to the database.",
+        LONG_DURATION_BUCKETS,
+    ),
+    "clicc_devices_sets_retrieved_total": (
+        "counter",
+        "Sets processed by retrieve_sets, by result: synced, skipped or failed.",
+        None,
+    ),
+    "clicc_devices_items_synced_total": (
+        "counter",
+        "Items in sets synced by retrieve_sets.",
+        None,
+    ),
+    "clicc_devices_item_changes_total": (
+        "counter",
+        "Items added or removed by retrieve_sets, by change.",
+        None,
+    ),
+    "clicc_devices_retrieval_runs_total": (
+        "counter",
+        "Completed retrieve_sets runs.",
+        None,
+    ),
+    "clicc_devices_retrieval_last_completed_timestamp_seconds": (
+        "gauge",
+        "Unix time when retrieve_sets last completed.",
+        None,
+    ),
+    "clicc_devices_retrieval_last_duration_seconds": (
+        "gauge",
+        "Time taken by the last retrieve_sets run.",
+        None,
+    ),
+    "clicc_devices_retrieval_last_items_per_second": (
+        "gauge",
+        "Items written per second of database time in the last retrieve_sets run.",
+        None,
+    ),
+    "clicc_devices_retrieval_last_max_rss_bytes": (
+        "gauge",
+        "Maximum resident set size of the last retrieve_sets process.",
+        None,
+    ),
+}
+LE_LABEL = re.compile(r'le="([^"]+)"')
+
+
+def format_labels(labels: dict) -> str:
+    """Format labels as in Prometheus text, sorted by name, with le last.
+
+    :param labels: Dictionary of {label name: value}.
+    :return: Labels like 'status="200",view="devices"', without braces.
+    """
+    names = sorted(labels, key=lambda name: (name == "le", name))
+    return ",".join(f'{name}="{_escape(str(labels[name]))}"' for name in names)
+
+
+class Metrics:
+    """Counters, gauges and histograms, shared by all processes through the database.
+
+    Changes are kept in memory and written at most every FLUSH_SECONDS,
+    so that requests don't each pay for a write. Processes
+    which exit, like retrieve_sets, must call flush() before they do.
+    Increments use UPDATE ... SET value = value + n, so concurrent
+    flushes from several processes are all counted.
+    """
+
+    FLUSH_SECONDS = 10
+
+    def __init__(self) -> None:
+        self._increments = Counter()
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """Add to a counter.
+
+        :param name: Counter name, from METRICS.
+        :param amount: Amount to add.
+        :param labels: Labels for this count.
+        :return: None
+        """
+        self._add({(name, format_labels(labels)): amount})
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a value in a histogram.
+
+        :param name: Histogram name, from METRICS.
+        :param value: Value observed, like a duration in seconds.
+        :param labels: Labels for this observation.
+        :return: None
+        """
+        buckets = METRICS[name][2]
+        increments = {
+            (f"{name}_sum", format_labels(labels)): value,
+            (f"{name}_count", format_labels(labels)): 1,
+        }
+        # Buckets are cumulative: each counts values up to and including its le.
+        for le in [*buckets, "+Inf"]:
+            if le == "+Inf" or value <= le:
+                key = (f"{name}_bucket", format_labels({**labels, "le": le}))
+                increments[key] = 1
+        self._add(increments)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge.
+
+        :param name: Gauge name, from METRICS.
+        :param value: New value.
+        :param labels: Labels for this value.
+        :return: None
+        """
+        with self._lock:
+            self._gauges[(name, format_labels(labels))] = value
+        self._flush_if_due()
+
+    def flush(self) -> None:
+        """Write pending changes to the database.
+
+        :return: None
+        """
+        with self._lock:
+            increments, self._increments = self._increments, Counter()
+            gauges, self._gauges = self._gauges, {}
+            self._last_flush = time.monotonic()
+        try:
+            with transaction.atomic():
+                # Same order in every process, so concurrent flushes can't deadlock.
+                for (name, labels), amount in sorted(increments.items()):
+                    _increment_sample(name, labels, amount)
+                for (name, labels), value in sorted(gauges.items()):
+                    MetricSample.objects.update_or_create(
+                        name=name, labels=labels, defaults={"value": value}
+                    )
+        except DatabaseError:
+            # Metrics must never break the request or command reporting them.
+            logger.exception("Failed to save metrics.")
+
+    def _add(self, increments: dict) -> None:
+        with self._lock:
+            self._increments.update(increments)
+        self._flush_if_due()
+
+    def _flush_if_due(self) -> None:
+        # Not inside a caller's transaction, which would keep the metric rows
+        # locked against other processes until it ended; the next call will flush.
+        if transaction.get_connection().in_atomic_block:
+            return
+        if time.monotonic() - self._last_flush >= self.FLUSH_SECONDS:
+            self.flush()
+
+
+def render_metrics() -> str:
+    """Get all metrics in the Prometheus text exposition format.
+
+    :return: Text with HELP, TYPE and sample lines for each metric family.
+    """
+    samples = {}
+    for name, labels, value in MetricSample.objects.values_list(
+        "name", "labels", "value"
+    ):
+        samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for family, (metric_type, help_text, _) in METRICS.items():
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        if metric_type == "histogram":
+            names = [f"{family}_bucket", f"{family}_sum", f"{family}_count"]
+        else:
+            names = [family]
+        family_samples = [
+            (name, labels, value)
+            for name in names
+            for labels, value in samples.get(name, [])
+        ]
+        for name, labels, value in sorted(family_samples, key=_sample_order):
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _increment_sample(name: str, labels: str, amount: float) -> None:
+    updated = MetricSample.objects.filter(name=name, labels=labels).update(
+        value=F("value") + amount
+    )
+    if updated:
+        return
+    try:
+        # Savepoint, so losing a race to create the row doesn't end the transaction.
+        with transaction.atomic():
+            MetricSample.objects.create(name=name, labels=labels, value=amount)
+    except IntegrityError:
+        MetricSample.objects.filter(name=name, labels=labels).update(
+            value=F("value") + amount
+        )
+
+
+def _sample_order(sample: tuple) -> tuple:
+    # Group a histogram's samples by labels, then buckets in increasing order.
+    name, labels, _ = sample
+    le = LE_LABEL.search(labels)
+    other_labels = LE_LABEL.sub("", labels).rstrip(",")
+    return (other_labels, name, float(le.group(1)) if le else 0)
+
+
+def _format_value(value: float) -> str:
+    # Whole numbers without ".0", and others without losing precision.
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
@@ -0,0 +1,270 @@
+from collections.abc import Callable
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+import time
+from wsgiref.headers import Headers
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import Redirect, StaticFile
+from whitenoise.string_utils import ensure_leading_trailing_slash
+from clicc_devices.compression import (
+    COMPRESSIBLE_TYPES,
+    MIN_COMPRESSION_SAVING,
+    compress,
+    compress_stream,
+    negotiate_encoding,
+)
+from clicc_devices.devices_export import (
+    EXPORT_NAME,
+    VARIANT_SUFFIXES,
+    VERSIONED_EXPORT_NAME,
+    current_export_name,
+)
+from clicc_devices.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimingMiddleware:
+    """Measure the database queries and time taken by each request.
+
+    Adds a Server-Timing header, shown in browsers' developer tools, with:
+    * db: total time of SQL queries, with their count,
+    * view: time taken by the view and the middleware after this one.
+    Also logs the same measurements as key=value pairs, except for requests
+    under settings.QUERY_TIMING_EXCLUDE_PATHS (like the log pages, which would
+    otherwise log their own polling). Requests taking at least
+    settings.SLOW_REQUEST_MS are logged as warnings, with their slowest queries.
+
+    Queries are counted on connections used by the request's own thread.
+    Request counts and durations, by view, are also recorded for /metrics/.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        timer = QueryTimer(settings.SLOW_REQUEST_QUERIES)
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = timer.duration * 1000
+
+        view = request.resolver_match.view_name if request.resolver_match else ""
+        metrics.increment(
+            "clicc_devices_http_requests_total",
+            view=view,
+            status=response.status_code,
+        )
+        metrics.observe(
+            "clicc_devices_http_request_duration_seconds", total_ms / 1000, view=view
+        )
+
+        response["Server-Timing"] = (
+            f'db;dur={db_ms:.1f};desc="{timer.count} queries", '
+            f"view;dur={total_ms:.1f}"
+        )
+        if request.path.startswith(tuple(settings.QUERY_TIMING_EXCLUDE_PATHS)):
+            return response
+
+        message = (
+            f"method={request.method} path={request.path} "
+            f"status={response.status_code} queries={timer.count} "
+            f"db_ms={db_ms:.1f} total_ms={total_ms:.1f}"
+        )
+        if total_ms >= settings.SLOW_REQUEST_MS:
+            slowest = "".join(
+                f"\n  {duration * 1000:.1f} ms: {sql}"
+                for duration, _, sql in timer.slowest()
+            )
+            logger.warning(f"Slow request: {message}{slowest}")
+        else:
+            logger.info(f"Request: {message}")
+        return response
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip, if the client accepts it.
+
+    Like Django's GZipMiddleware, but also with brotli, and only for text-like
+    media types of at least settings.COMPRESSION_MIN_BYTES. Responses which
+    are already compressed, like the cached /devices/ payload, are left alone.
+    Streamed responses are compressed chunk by chunk, each sent as soon as
+    it's ready.
+
+    Pages with a CSRF token are only compressed with gzip, padded to a random
+    length as GZipMiddleware does, to mitigate the BREACH attack.
+    """
+
+    # As in GZipMiddleware.
+    max_random_bytes = 100
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        response = self.get_response(request)
+        content_type = response.get("Content-Type", "")
+        if (
+            response.has_header("Content-Encoding")
+            or not content_type.startswith(COMPRESSIBLE_TYPES)
+            or getattr(response, "is_async", False)
+        ):
+            return response
+        patch_vary_headers(response, ["Accept-Encoding"])
+        if not response.streaming and (
+            len(response.content) < settings.COMPRESSION_MIN_BYTES
+        ):
+            return response
+
+        # The CSRF middleware sets its cookie on responses which use the token.
+        has_csrf_token = settings.CSRF_COOKIE_NAME in response.cookies
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+        if has_csrf_token:
+            encoding = negotiate_encoding(accept_encoding, available=["gzip"])
+        else:
+            encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if has_csrf_token:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content, max_random_bytes=self.max_random_bytes
+                )
+            else:
+                response.streaming_content = compress_stream(
+                    response.streaming_content, encoding
+                )
+            # The compressed length isn't known until it has all been sent.
+            del response.headers["Content-Length"]
+        else:
+            if has_csrf_token:
+                compressed = compress_string(
+                    response.content, max_random_bytes=self.max_random_bytes
+                )
+            else:
+                compressed = compress(response.content, encoding)
+            if len(compressed) > len(response.content) * (1 - MIN_COMPRESSION_SAVING):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # Compressed bytes differ, so a strong ETag must be made weak, as in
+        # GZipMiddleware; conditional requests still match it.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = f"W/{etag}"
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class DevicesExportMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise, also serving the static /devices/ export under
+    settings.DEVICES_EXPORT_URL, from settings.DEVICES_EXPORT_DIR.
+
+    WhiteNoise finds static files once, when it starts, but the export is
+    replaced whenever the device summary is rebuilt, so its files are looked
+    up on each request. Versioned files, like devices.0123456789ab.json, never
+    change, so they're cached forever; devices.json redirects to the current one.
+    Gzip and brotli variants are served to clients which accept them.
+    Unlike other static files, the export doesn't allow all origins: CorsMiddleware
+    adds CORS headers for the same origins as the API.
+    """
+
+    def __init__(self, get_response=None, settings=settings) -> None:
+        super().__init__(get_response, settings=settings)
+        self.export_prefix = ensure_leading_trailing_slash(settings.DEVICES_EXPORT_URL)
+        self.export_dir = settings.DEVICES_EXPORT_DIR
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if request.path_info.startswith(self.export_prefix):
+            static_file = self.find_export_file(request.path_info)
+            if static_file is not None:
+                return self.serve(static_file, request)
+        return super().__call__(request)
+
+    def find_export_file(self, url: str):
+        """Find a file in the export.
+
+        :param url: URL path, starting with the export prefix.
+        :return: WhiteNoise StaticFile or Redirect, or None if there's no such file.
+        """
+        name = url[len(self.export_prefix) :]
+        if name == EXPORT_NAME:
+            current = current_export_name(self.export_dir)
+            if current is None:
+                return None
+            headers = {}
+            if self.max_age is not None:
+                headers["Cache-Control"] = f"max-age={self.max_age}, public"
+            # Relative, as in WhiteNoise's own redirects.
+            return Redirect(current, headers=headers)
+        # Only versioned files; not compressed variants, temporary files or paths.
+        if not VERSIONED_EXPORT_NAME.fullmatch(name):
+            return None
+        path = os.path.join(self.export_dir, name)
+        if not os.path.exists(path):
+            return None
+        # As get_static_file() does, without its Access-Control-Allow-Origin: *.
+        headers = Headers([])
+        self.add_mime_headers(headers, path, url)
+        self.add_cache_headers(headers, path, url)
+        if self.add_headers_function is not None:
+            self.add_headers_function(headers, path, url)
+        encodings = {
+            encoding: path + suffix for encoding, suffix in VARIANT_SUFFIXES.items()
+        }
+        return StaticFile(path, headers.items(), encodings=encodings)
+
+    def immutable_file_test(self, path: str, url: str) -> bool:
+        if url.startswith(self.export_prefix):
+            return bool(VERSIONED_EXPORT_NAME.fullmatch(url[len(self.export_prefix) :]))
+        return super().immutable_file_test(path, url)
+
+
+class QueryTimer:
+    """Database execute wrapper which counts and times queries,
+    keeping the slowest few.
+
+    :param keep: Number of slowest queries to keep.
+    """
+
+    def __init__(self, keep: int) -> None:
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        # Min-heap of (duration, sequence, sql); sequence breaks ties.
+        self._slowest = []
+        self._sequence = itertools.count()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            entry = (duration, next(self._sequence), sql)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self) -> list[tuple]:
+        """Get the slowest queries.
+
+        :return: List of (duration in seconds, sequence, SQL), slowest first.
+        """
+        return sorted(self._slowest, reverse=True)
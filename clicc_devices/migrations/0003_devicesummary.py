@@ -0,0 +1,66 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:09
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.utils import timezone
+
+
+def build_initial_summary(apps, schema_editor):
+    # Populate the summary from existing data, so /devices/ is correct
+    # before the next run of retrieve_sets.
+    Set = apps.get_model("clicc_devices", "Set")
+    DeviceSummary = apps.get_model("clicc_devices", "DeviceSummary")
+    built = timezone.now()
+    rows = (
+        Set.objects.values("unit", "type__name")
+        .annotate(item_count=Count("items"), retrieved=Max("retrieved"))
+        .order_by("unit", "type__name")
+    )
+    DeviceSummary.objects.bulk_create(
+        DeviceSummary(
+            unit=row["unit"],
+            item_type=row["type__name"],
+            item_count=row["item_count"],
+            retrieved=row["retrieved"],
+            built=built,
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0002_cronjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("unit", models.CharField(max_length=100)),
+                ("item_type", models.CharField(max_length=100)),
+                ("item_count", models.PositiveIntegerField(default=0)),
+                ("retrieved", models.DateTimeField(null=True)),
+                ("built", models.DateTimeField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("unit", "item_type"),
+                        name="unique_device_summary_unit_type",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_initial_summary, migrations.RunPython.noop),
+    ]
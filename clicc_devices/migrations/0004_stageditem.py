@@ -0,0 +1,44 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0003_devicesummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StagedItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("barcode", models.CharField(max_length=128)),
+                (
+                    "set",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="staged_items",
+                        to="clicc_devices.set",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["set", "barcode"], name="clicc_devic_set_id_09d4ef_idx"
+                    )
+                ],
+            },
+        ),
+    ]
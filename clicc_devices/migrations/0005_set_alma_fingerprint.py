@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0004_stageditem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="set",
+            name="alma_fingerprint",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
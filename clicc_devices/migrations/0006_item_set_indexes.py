@@ -0,0 +1,40 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:17
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_items(apps, schema_editor):
+    # Before retrieve_sets compared barcodes, a set could get the same barcode
+    # more than once. Keep the first of each, so the unique constraint can be added.
+    Item = apps.get_model("clicc_devices", "Item")
+    duplicates = (
+        Item.objects.values("set_id", "barcode")
+        .annotate(first_id=Min("id"), count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        Item.objects.filter(
+            set_id=duplicate["set_id"], barcode=duplicate["barcode"]
+        ).exclude(id=duplicate["first_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0005_set_alma_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="set",
+            index=models.Index(fields=["unit", "type"], name="set_unit_type_idx"),
+        ),
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="item",
+            constraint=models.UniqueConstraint(
+                fields=("set", "barcode"), name="unique_item_set_barcode"
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0006_item_set_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetricSample",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=200)),
+                ("labels", models.CharField(blank=True, default="", max_length=500)),
+                ("value", models.FloatField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("name", "labels"),
+                        name="unique_metric_sample_name_labels",
+                    )
+                ],
+            },
+        ),
+    ]
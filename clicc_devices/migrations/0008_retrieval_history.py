@@ -0,0 +1,88 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0007_metricsample"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RetrievalRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started", models.DateTimeField()),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                ("options", models.CharField(blank=True, default="", max_length=200)),
+                ("sets_synced", models.PositiveIntegerField(default=0)),
+                ("sets_skipped", models.PositiveIntegerField(default=0)),
+                ("sets_failed", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["-started"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SetRetrieval",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("alma_set_id", models.CharField(max_length=255)),
+                ("name", models.CharField(max_length=255)),
+                ("started", models.DateTimeField()),
+                (
+                    "result",
+                    models.CharField(
+                        choices=[
+                            ("synced", "Synced"),
+                            ("skipped", "Skipped"),
+                            ("failed", "Failed"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("alma_seconds", models.FloatField(blank=True, null=True)),
+                ("write_seconds", models.FloatField(blank=True, null=True)),
+                ("added", models.PositiveIntegerField(blank=True, null=True)),
+                ("removed", models.PositiveIntegerField(blank=True, null=True)),
+                ("unchanged", models.PositiveIntegerField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, default="")),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="set_retrievals",
+                        to="clicc_devices.retrievalrun",
+                    ),
+                ),
+                (
+                    "set",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="clicc_devices.set",
+                    ),
+                ),
+            ],
+        ),
+    ]
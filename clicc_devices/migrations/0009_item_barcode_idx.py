@@ -0,0 +1,17 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0008_retrieval_history"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="item",
+            index=models.Index(fields=["barcode"], name="item_barcode_idx"),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0009_item_barcode_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceCountSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("unit", models.CharField(max_length=100)),
+                ("item_type", models.CharField(max_length=100)),
+                ("item_count", models.PositiveIntegerField(default=0)),
+                ("taken", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["unit", "item_type", "taken"],
+                        name="snapshot_unit_type_idx",
+                    )
+                ],
+            },
+        ),
+    ]
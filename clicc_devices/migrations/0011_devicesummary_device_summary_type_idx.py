@@ -0,0 +1,17 @@
+# Generated by Django 5.2.14 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clicc_devices", "0010_devicecountsnapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="devicesummary",
+            index=models.Index(fields=["item_type"], name="device_summary_type_idx"),
+        ),
+    ]
@@ -9,6 +9,13 @@ class Set(models.Model):
     unit = models.CharField(max_length=100)
     type = models.ForeignKey("ItemType", related_name="sets", on_delete=models.PROTECT)
     retrieved = models.DateTimeField()
+    # Summary of the Alma set's metadata when it was last retrieved,
+    # used by retrieve_sets --changed_only to skip unchanged sets.
+    alma_fingerprint = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        # Sets are filtered and grouped by unit, and by unit and type.
+        indexes = [models.Index(fields=["unit", "type"], name="set_unit_type_idx")]
 
     def __str__(self):
         return f"{self.name} ({self.unit}) - {self.type}"
@@ -25,10 +32,30 @@ class Item(models.Model):
     set = models.ForeignKey(Set, related_name="items", on_delete=models.CASCADE)
     barcode = models.CharField(max_length=128)  # Alma barcodes character limit is 128
 
+    class Meta:
+        # Also serves lookups of a set's items, and of barcodes within a set.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["set", "barcode"], name="unique_item_set_barcode"
+            )
+        ]
+        # Barcode lookups across all sets (/devices/barcode/).
+        indexes = [models.Index(fields=["barcode"], name="item_barcode_idx")]
+
     def __str__(self):
         return f"{self.barcode} ({self.set.unit})"
 
 
+class StagedItem(models.Model):
+    # Barcodes retrieved from Alma, held temporarily while a Set is streamed in,
+    # so the Set's Items can be updated with set-based SQL instead of in memory.
+    set = models.ForeignKey(Set, related_name="staged_items", on_delete=models.CASCADE)
+    barcode = models.CharField(max_length=128)
+
+    class Meta:
+        indexes = [models.Index(fields=["set", "barcode"])]
+
+
 class CronJob(models.Model):
     # Use charfield to support wildcards and intervals.
     # No attempt at validation.
@@ -63,3 +90,121 @@ class CronJob(models.Model):
             kwargs.pop("force_insert", None)
         self.id = self.permanent_id
         super().save(*args, **kwargs)
+
+
+class DeviceSummary(models.Model):
+    # Pre-aggregated item counts per unit and item type, rebuilt by retrieve_sets.
+    # Item type is stored by name, so reading the summary needs no joins.
+    unit = models.CharField(max_length=100)
+    item_type = models.CharField(max_length=100)
+    item_count = models.PositiveIntegerField(default=0)
+    # Most recent retrieval of any set contributing to this row.
+    retrieved = models.DateTimeField(null=True)
+    # When the summary was rebuilt; the same for all rows in one rebuild.
+    built = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["unit", "item_type"], name="unique_device_summary_unit_type"
+            )
+        ]
+        # For /devices/?type=; filtering by unit uses the unique constraint's index.
+        indexes = [models.Index(fields=["item_type"], name="device_summary_type_idx")]
+
+    def __str__(self):
+        return f"{self.unit} - {self.item_type}: {self.item_count}"
+
+
+class MetricSample(models.Model):
+    # Current value of one metric sample for /metrics/, shared by all processes.
+    # See clicc_devices.metrics. Histograms have a sample per bucket,
+    # plus _sum and _count.
+    name = models.CharField(max_length=200)
+    # Labels in Prometheus format, like 'status="200",view="devices"'.
+    labels = models.CharField(max_length=500, blank=True, default="")
+    value = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "labels"], name="unique_metric_sample_name_labels"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name}{{{self.labels}}} {self.value}"
+
+
+class RetrievalRun(models.Model):
+    # One run of the retrieve_sets command, with its per-set results in set_retrievals.
+    started = models.DateTimeField()
+    # Null while running, or if the run was interrupted.
+    finished = models.DateTimeField(null=True, blank=True)
+    # Command line options which affect performance, like "--workers 4 --stream".
+    options = models.CharField(max_length=200, blank=True, default="")
+    sets_synced = models.PositiveIntegerField(default=0)
+    sets_skipped = models.PositiveIntegerField(default=0)
+    sets_failed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-started"]
+
+    def __str__(self):
+        return f"Retrieval run {self.started}"
+
+    @property
+    def duration(self) -> float | None:
+        if self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+
+class SetRetrieval(models.Model):
+    # The result of retrieving one set in a RetrievalRun.
+    RESULT_CHOICES = [
+        ("synced", "Synced"),
+        ("skipped", "Skipped"),
+        ("failed", "Failed"),
+    ]
+    run = models.ForeignKey(
+        RetrievalRun, on_delete=models.CASCADE, related_name="set_retrievals"
+    )
+    # The set may be deleted later; alma_set_id and name keep the history readable.
+    set = models.ForeignKey(Set, on_delete=models.SET_NULL, null=True, blank=True)
+    alma_set_id = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    started = models.DateTimeField()
+    result = models.CharField(max_length=10, choices=RESULT_CHOICES)
+    # Time spent retrieving the set from Alma (including staging, with --stream),
+    # and writing its items to the database.
+    alma_seconds = models.FloatField(null=True, blank=True)
+    write_seconds = models.FloatField(null=True, blank=True)
+    added = models.PositiveIntegerField(null=True, blank=True)
+    removed = models.PositiveIntegerField(null=True, blank=True)
+    unchanged = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"{self.name} ({self.alma_set_id}): {self.result}"
+
+
+class DeviceCountSnapshot(models.Model):
+    # Item counts per unit and item type as of one retrieve_sets run,
+    # copied from DeviceSummary, for /devices/history/.
+    unit = models.CharField(max_length=100)
+    item_type = models.CharField(max_length=100)
+    item_count = models.PositiveIntegerField(default=0)
+    # The same for all rows from one run.
+    taken = models.DateTimeField()
+
+    class Meta:
+        # History is queried for a unit and type over a range of time.
+        indexes = [
+            models.Index(
+                fields=["unit", "item_type", "taken"], name="snapshot_unit_type_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.unit} - {self.item_type} at {self.taken}: {self.item_count}"
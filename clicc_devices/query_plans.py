@@ -0,0 +1,94 @@
+import logging
+import re
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from clicc_devices.models import (
+    DeviceCountSnapshot,
+    DeviceSummary,
+    Item,
+    Set,
+    StagedItem,
+)
+from clicc_devices.retrieval import stale_items
+
+logger = logging.getLogger(__name__)
+
+# Text in EXPLAIN output showing that an index is used, by database vendor.
+INDEX_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Index Scan|Index Only Scan|Bitmap Index Scan"),
+    "sqlite": re.compile(r"USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY"),
+}
+
+
+def hot_path_queries() -> dict[str, QuerySet]:
+    """The application's most frequent queries, which should all use an index.
+
+    Parameter values don't matter for EXPLAIN, so placeholders are used.
+
+    :return: Dictionary of {description: queryset}.
+    """
+    return {
+        "Items in a set (retrieve_sets)": Item.objects.filter(set_id=1).values_list(
+            "barcode", flat=True
+        ),
+        "Items by set and barcode (retrieve_sets)": Item.objects.filter(
+            set_id=1, barcode__in=["barcode1", "barcode2"]
+        ),
+        "Items by barcode (barcode lookup)": Item.objects.filter(
+            barcode__in=["barcode1", "barcode2"]
+        ),
+        "Staged items in a set (retrieve_sets --stream)": StagedItem.objects.filter(
+            set_id=1
+        ).values_list("barcode", flat=True),
+        "Items not staged in a set (retrieve_sets --stream)": stale_items(Set(pk=1)),
+        "Sets by unit (Sets page)": Set.objects.filter(unit="unit"),
+        "Sets by unit and type (Sets page)": Set.objects.filter(unit="unit", type_id=1),
+        "Device summary (/devices/)": DeviceSummary.objects.order_by(
+            "unit", "item_type"
+        ),
+        "Device summary by unit (/devices/?unit=)": DeviceSummary.objects.filter(
+            unit="unit"
+        ).order_by("unit", "item_type"),
+        "Device summary by type (/devices/?type=)": DeviceSummary.objects.filter(
+            item_type="type"
+        ).order_by("unit", "item_type"),
+        "Device count history (/devices/history/)": DeviceCountSnapshot.objects.filter(
+            unit="unit",
+            item_type="type",
+            taken__gte="2000-01-01T00:00:00Z",
+            taken__lte="2001-01-01T00:00:00Z",
+        ),
+    }
+
+
+def check_query_plans() -> tuple[dict[str, str], list[str]]:
+    """Get query plans for hot_path_queries(), and check that each uses an index.
+
+    On PostgreSQL, sequential scans are disabled while planning: with little data,
+    the planner would rightly prefer them, but the point here is to show that a
+    usable index exists.
+
+    Other databases' plans can't be checked, so they're skipped with a warning.
+
+    :return: Tuple of {description: plan} and a list of descriptions of
+        queries which don't use an index; both empty if the check was skipped.
+    """
+    pattern = INDEX_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        logger.warning(
+            f"Query plans not checked: unsupported database {connection.vendor}."
+        )
+        return {}, []
+
+    plans = {}
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                # SET LOCAL only lasts until the end of this transaction.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        for description, queryset in hot_path_queries().items():
+            plans[description] = queryset.explain()
+    failures = [
+        description for description, plan in plans.items() if not pattern.search(plan)
+    ]
+    return plans, failures
@@ -0,0 +1,224 @@
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, QuerySet
+from django.utils import timezone
+from clicc_devices.models import Item, Set, StagedItem
+
+# Number of Items written per INSERT statement.
+DEFAULT_BATCH_SIZE = 1000
+
+
+def batches(values: Iterable, batch_size: int) -> Iterator[list]:
+    """Split values into lists of at most batch_size elements.
+
+    :param values: Any iterable, including generators.
+    :param batch_size: Maximum number of elements per list.
+    :return: Iterator of lists.
+    """
+    iterator = iter(values)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+class RateLimiter:
+    """Spaces out calls to wait(), across all threads, to a maximum rate.
+
+    :param max_per_second: Maximum calls per second, or None for no limit.
+    """
+
+    def __init__(self, max_per_second: float | None) -> None:
+        self._interval = 1 / max_per_second if max_per_second else 0
+        self._next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until the caller is allowed to proceed.
+
+        :return: None
+        """
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def run_concurrently(
+    function: Callable, values: Iterable, workers: int
+) -> Iterator[tuple]:
+    """Call function on each value, using a bounded pool of threads.
+
+    Results are yielded in the calling thread as they complete, so the
+    caller can safely use them (for example, to write to the database)
+    while other calls are still running. At most 2 * workers calls are
+    in progress or waiting to be consumed at any time.
+
+    :param function: Function taking a single value.
+    :param values: Values to call function with.
+    :param workers: Number of threads. With 1, calls are made in the calling
+        thread, one at a time.
+    :return: Iterator of (value, result) tuples, in order of completion.
+    """
+    if workers <= 1:
+        for value in values:
+            yield value, function(value)
+        return
+
+    values = iter(values)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(function, value): value
+            for value in islice(values, 2 * workers)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                value = pending.pop(future)
+                yield value, future.result()
+                for next_value in islice(values, 1):
+                    pending[executor.submit(function, next_value)] = next_value
+
+
+def sync_set_items(
+    set_obj: Set, barcodes: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE
+) -> dict:
+    """Update the Items in a Set to match the given barcodes.
+
+    Only the differences are written: Items for new barcodes are inserted,
+    Items for barcodes no longer present are deleted, and the rest are left
+    alone, so a Set with no changes costs one SELECT and one UPDATE.
+
+    Everything happens in one transaction: other connections keep seeing
+    the previous Items until all changes are written, and nothing changes
+    if writing fails part way through.
+
+    :param set_obj: The Set to update.
+    :param barcodes: Barcodes of the Set's members. Duplicates are ignored.
+    :param batch_size: Number of barcodes per INSERT or DELETE statement.
+    :return: Dictionary with counts of "added", "removed" and "unchanged" Items.
+    """
+    incoming = set(barcodes)
+    with transaction.atomic():
+        existing = set(
+            Item.objects.filter(set=set_obj).values_list("barcode", flat=True)
+        )
+        to_add = incoming - existing
+        to_remove = existing - incoming
+        for batch in batches(to_remove, batch_size):
+            Item.objects.filter(set=set_obj, barcode__in=batch).delete()
+        for batch in batches(to_add, batch_size):
+            Item.objects.bulk_create(Item(set=set_obj, barcode=b) for b in batch)
+        set_obj.retrieved = timezone.now()
+        set_obj.save(update_fields=["retrieved"])
+    return {
+        "added": len(to_add),
+        "removed": len(to_remove),
+        "unchanged": len(incoming & existing),
+    }
+
+
+def copy_supported() -> bool:
+    """Check whether the database can load rows with COPY (PostgreSQL with psycopg 3).
+
+    :return: True if stage_set_items() can use COPY.
+    """
+    return connection.vendor == "postgresql"
+
+
+def stage_set_items(
+    set_obj: Set,
+    pages: Iterable[list[str]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    use_copy: bool = False,
+) -> int:
+    """Write barcodes to the staging table as they arrive, one page at a time.
+
+    Any rows left over from an earlier, interrupted run are removed first.
+    Only one page (plus one batch) is held in memory at any time.
+
+    :param set_obj: The Set the barcodes belong to.
+    :param pages: Iterable of lists of barcodes, typically a generator
+        reading pages from Alma.
+    :param batch_size: Number of barcodes per INSERT statement.
+    :param use_copy: Load all rows with a single COPY instead of batched INSERTs.
+        Requires PostgreSQL; see copy_supported().
+    :return: The number of barcodes staged.
+    """
+    StagedItem.objects.filter(set=set_obj).delete()
+    staged = 0
+    if use_copy:
+        staged_table = StagedItem._meta.db_table
+        with connection.cursor() as cursor:
+            with cursor.copy(
+                f"COPY {staged_table} (set_id, barcode) FROM STDIN"
+            ) as copy:
+                for page in pages:
+                    for barcode in page:
+                        copy.write_row((set_obj.pk, barcode))
+                    staged += len(page)
+        return staged
+
+    for page in pages:
+        for batch in batches(page, batch_size):
+            StagedItem.objects.bulk_create(
+                StagedItem(set=set_obj, barcode=b) for b in batch
+            )
+            staged += len(batch)
+    return staged
+
+
+def stale_items(set_obj: Set) -> QuerySet:
+    """Get the Items in a Set whose barcodes aren't staged.
+
+    NOT EXISTS, rather than NOT IN, so PostgreSQL can use an anti-join on the
+    staged items' index, however large the Set.
+
+    :param set_obj: The Set.
+    :return: Queryset of Items.
+    """
+    return Item.objects.filter(set=set_obj).filter(
+        ~Exists(StagedItem.objects.filter(set=set_obj, barcode=OuterRef("barcode")))
+    )
+
+
+def apply_staged_items(set_obj: Set) -> dict:
+    """Update the Items in a Set to match its staged barcodes, then clear them.
+
+    Like sync_set_items(), only the differences are written, in one
+    transaction, but the comparison is done by the database, so memory
+    use doesn't depend on the size of the Set.
+
+    :param set_obj: The Set to update.
+    :return: Dictionary with counts of "added", "removed" and "unchanged" Items.
+    """
+    staged = StagedItem.objects.filter(set=set_obj)
+    item_table = Item._meta.db_table
+    staged_table = StagedItem._meta.db_table
+    with transaction.atomic():
+        removed, _ = stale_items(set_obj).delete()
+        # INSERT ... SELECT has no ORM equivalent; this is portable SQL.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {item_table} (set_id, barcode)
+                SELECT DISTINCT s.set_id, s.barcode FROM {staged_table} s
+                WHERE s.set_id = %s AND NOT EXISTS (
+                    SELECT 1 FROM {item_table} i
+                    WHERE i.set_id = s.set_id AND i.barcode = s.barcode
+                )
+                """,
+                [set_obj.pk],
+            )
+            added = cursor.rowcount
+        unchanged = staged.values("barcode").distinct().count() - added
+        staged.delete()
+        set_obj.retrieved = timezone.now()
+        set_obj.save(update_fields=["retrieved"])
+    return {"added": added, "removed": removed, "unchanged": unchanged}
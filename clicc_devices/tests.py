@@ -1,8 +1,105 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
 from django.core.management import call_command
 from django.utils import timezone
-from .models import CronJob, Set, ItemType, Item
+from . import device_data, log_index, query_plans, views
+from .device_data import (
+    DEVICES_CACHE,
+    DEVICES_GENERATION_KEY,
+    DEVICES_STATE_CACHE,
+    devices_cache_totals,
+    rebuild_device_summary,
+    snapshot_device_counts,
+)
+from .alma import AlmaRequestError, AlmaSetMembersClient
+from .alma_offline import FakeAlmaClient, RecordingAlmaClient, ReplayAlmaClient
+from .compression import ENCODINGS, brotli, negotiate_encoding
+from .devices_export import EXPORT_VERSIONS_KEPT, current_export_name, export_devices
+from .benchmark import run_benchmark
+from .models import (
+    CronJob,
+    DeviceCountSnapshot,
+    DeviceSummary,
+    Set,
+    ItemType,
+    Item,
+    MetricSample,
+    RetrievalRun,
+    SetRetrieval,
+    StagedItem,
+)
+from .log_handlers import MultiProcessRotatingFileHandler
+from .middleware import CompressionMiddleware
+from .metrics import Metrics, metrics, render_metrics
+from .log_index import filter_log_records, get_log_index, log_files
+from .log_reader import (
+    format_cursor,
+    parse_cursor,
+    read_new_lines,
+    tail_lines,
+    tail_lines_with_cursor,
+)
+from .query_plans import check_query_plans
+from .retrieval import (
+    RateLimiter,
+    apply_staged_items,
+    copy_supported,
+    run_concurrently,
+    stage_set_items,
+    sync_set_items,
+)
+from datetime import datetime, timedelta
 from io import StringIO
+import gzip
+import json
+import logging
+import requests
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+import threading
+import time
+import zlib
+from unittest import mock, skipIf, skipUnless
+
+# Keep tests away from the file-based cache used by the running application.
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    DEVICES_CACHE: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "devices-tests",
+    },
+    DEVICES_STATE_CACHE: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "devices-state-tests",
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DevicesCacheTestCase(TestCase):
+    # Base class for tests of the cached /devices/ endpoint;
+    # each test starts with an empty cache and no hit / miss counts,
+    # and exports to a temporary directory.
+    def setUp(self):
+        # Discard counts from earlier tests; rolled back after each test.
+        metrics.flush()
+        MetricSample.objects.all().delete()
+        caches[DEVICES_CACHE].clear()
+        caches[DEVICES_STATE_CACHE].clear()
+        export_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(DEVICES_EXPORT_DIR=export_dir))
 
 
 class CronTest(TestCase):
@@ -46,7 +143,7 @@ class CronTest(TestCase):
         self.assertEqual(expected, "#0 0 1 1 * echo 'Hello' >> /tmp/cron.log 2>&1\n")
 
 
-class DeviceViewTests(TestCase):
+class DeviceViewTests(DevicesCacheTestCase):
 
     # Create some sample data for testing
     @classmethod
@@ -87,6 +184,9 @@ class DeviceViewTests(TestCase):
         for i in range(5):
             Item.objects.create(set=set3, barcode=f"barcode_a2_{i+1}")
 
+        # The endpoint reads pre-aggregated counts, normally built by retrieve_sets.
+        rebuild_device_summary()
+
     def test_devices_view_structure(self):
         response = self.client.get("/devices/")
         data = response.json()
@@ -99,8 +199,570 @@ class DeviceViewTests(TestCase):
         self.assertEqual(unit1_data["typeA"], 8)  # 3 from set1 + 5 from set3
         self.assertEqual(unit1_data["typeB"], 4)
 
+    def test_devices_view_uses_single_query(self):
+        # Counts are read from the summary table, regardless of the number of sets.
+        with self.assertNumQueries(1):
+            self.client.get("/devices/")
+
+    def test_devices_view_includes_empty_sets(self):
+        # A set with no items should still be reported, with a count of 0.
+        type_c = ItemType.objects.create(name="typeC")
+        Set.objects.create(
+            alma_set_id="set4",
+            name="Set 4",
+            unit="unit2",
+            type=type_c,
+            retrieved=timezone.now(),
+        )
+        rebuild_device_summary()
+        data = self.client.get("/devices/").json()
+        self.assertEqual(data["unit2"], {"typeC": 0})
+
+    def test_devices_view_reads_summary(self):
+        # New items are not visible until the summary is rebuilt.
+        set1 = Set.objects.get(alma_set_id="set1")
+        Item.objects.create(set=set1, barcode="barcode_a_new")
+        data = self.client.get("/devices/").json()
+        self.assertEqual(data["unit1"]["typeA"], 8)
+        # The cached response is replaced once the rebuild is committed.
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+        data = self.client.get("/devices/").json()
+        self.assertEqual(data["unit1"]["typeA"], 9)
+
+    def test_rebuild_replaces_summary_rows(self):
+        rebuild_device_summary()
+        # One row per unit / item type combination, no leftovers from earlier builds.
+        self.assertEqual(DeviceSummary.objects.count(), 2)
+        self.assertEqual(len(set(DeviceSummary.objects.values_list("built"))), 1)
+
+    def test_devices_filtered_by_unit_and_type(self):
+        type_c = ItemType.objects.create(name="typeC")
+        Set.objects.create(
+            alma_set_id="set4",
+            name="Set 4",
+            unit="unit2",
+            type=type_c,
+            retrieved=timezone.now(),
+        )
+        rebuild_device_summary()
+        data = self.client.get("/devices/", {"unit": "unit1"}).json()
+        self.assertEqual(data, {"unit1": {"typeA": 8, "typeB": 4}})
+        data = self.client.get("/devices/", {"unit": "unit1", "type": "typeB"}).json()
+        self.assertEqual(data, {"unit1": {"typeB": 4}})
+        data = self.client.get("/devices/", {"type": "typeC"}).json()
+        self.assertEqual(data, {"unit2": {"typeC": 0}})
+        data = self.client.get("/devices/", {"unit": "unknown"}).json()
+        self.assertEqual(data, {})
+
+    def test_devices_flat_format(self):
+        data = self.client.get("/devices/", {"format": "flat", "type": "typeA"}).json()
+        self.assertEqual(
+            data, [{"unit": "unit1", "item_type": "typeA", "item_count": 8}]
+        )
+        response = self.client.get("/devices/", {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filtered_devices_cached_separately(self):
+        # One query for each combination, then none until the summary is rebuilt.
+        with self.assertNumQueries(2):
+            unit1 = self.client.get("/devices/", {"unit": "unit1", "type": "typeA"})
+            flat = self.client.get("/devices/", {"unit": "unit1", "format": "flat"})
+        with self.assertNumQueries(0):
+            unit1_again = self.client.get(
+                "/devices/", {"unit": "unit1", "type": "typeA"}
+            )
+            flat_again = self.client.get(
+                "/devices/", {"unit": "unit1", "format": "flat"}
+            )
+        self.assertEqual(unit1_again.headers["X-Cache"], "HIT")
+        self.assertEqual(unit1.content, unit1_again.content)
+        self.assertEqual(flat.content, flat_again.content)
+        self.assertNotEqual(unit1.content, flat.content)
+
+        Item.objects.create(set=Set.objects.get(alma_set_id="set1"), barcode="new")
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+        response = self.client.get("/devices/", {"unit": "unit1", "type": "typeA"})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertEqual(response.json(), {"unit1": {"typeA": 9}})
+
+    def test_unknown_filters_not_cached(self):
+        for i in range(3):
+            response = self.client.get("/devices/", {"unit": f"unknown{i}"})
+            self.assertEqual(response.json(), {})
+        response = self.client.get("/devices/", {"unit": "unknown0"})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+
+    def test_generation_not_in_payload_cache(self):
+        # Culling payloads can't lose the generation, and with it bring back
+        # payloads from before a rebuild.
+        self.client.get("/devices/", {"unit": "unit1"})
+        Item.objects.create(set=Set.objects.get(alma_set_id="set1"), barcode="new")
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+        self.assertIsNone(caches[DEVICES_CACHE].get(DEVICES_GENERATION_KEY))
+        self.assertEqual(caches[DEVICES_STATE_CACHE].get(DEVICES_GENERATION_KEY), 1)
+        data = self.client.get("/devices/", {"unit": "unit1"}).json()
+        self.assertEqual(data, {"unit1": {"typeA": 9, "typeB": 4}})
+
+    def test_payload_built_before_rebuild_not_served_after(self):
+        build = device_data.build_devices_payload
+        item_set = Set.objects.get(alma_set_id="set1")
+
+        def build_during_rebuild(*args, **kwargs):
+            # Built from the old summary, then the summary is rebuilt
+            # before the old payload is stored.
+            payload = build(*args, **kwargs)
+            patched.side_effect = build
+            Item.objects.create(set=item_set, barcode="new")
+            with self.captureOnCommitCallbacks(execute=True):
+                rebuild_device_summary()
+            return payload
+
+        cache = caches[DEVICES_CACHE]
+        with (
+            mock.patch.object(
+                device_data, "build_devices_payload", side_effect=build_during_rebuild
+            ) as patched,
+            # As on the file-based cache, where add() checks for the key before
+            # the rebuild stores it, then writes anyway.
+            mock.patch.object(cache, "add", side_effect=cache.set),
+        ):
+            old = self.client.get("/devices/").json()
+        response = self.client.get("/devices/")
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+        self.assertEqual(old["unit1"]["typeA"], 8)
+        self.assertEqual(response.json()["unit1"]["typeA"], 9)
+
+    def test_filtered_devices_use_indexes(self):
+        plans, failures = check_query_plans()
+        self.assertNotIn("Device summary by unit (/devices/?unit=)", failures)
+        self.assertNotIn("Device summary by type (/devices/?type=)", failures)
+
+
+class DevicesExportTests(DevicesCacheTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        set_obj = Set.objects.create(
+            alma_set_id="set1",
+            name="Set 1",
+            unit="unit1",
+            type=item_type,
+            retrieved=timezone.now(),
+        )
+        Item.objects.bulk_create(
+            Item(set=set_obj, barcode=f"barcode_{i}") for i in range(3)
+        )
+
+    def rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+
+    def test_rebuild_exports_devices(self):
+        self.rebuild()
+        name = current_export_name()
+        self.assertRegex(name, r"^devices\.[0-9a-f]{12}\.json$")
+        with open(os.path.join(settings.DEVICES_EXPORT_DIR, name), "rb") as f:
+            self.assertEqual(f.read(), self.client.get("/devices/").content)
+
+    def test_export_served_without_queries(self):
+        self.rebuild()
+        with self.assertNumQueries(0):
+            redirect = self.client.get("/export/devices.json")
+        self.assertEqual(redirect.status_code, 302)
+        versioned_url = f"/export/{redirect.headers['Location']}"
+        with self.assertNumQueries(0):
+            response = self.client.get(versioned_url)
+        self.assertEqual(
+            b"".join(response.streaming_content), b'{"unit1": {"typeA": 3}}'
+        )
+        self.assertIn("immutable", response.headers["Cache-Control"])
+
+    def test_export_devices_command(self):
+        self.rebuild()
+        shutil.rmtree(settings.DEVICES_EXPORT_DIR)
+        out = StringIO()
+        call_command("export_devices", stdout=out)
+        name = current_export_name()
+        self.assertIn(name, out.getvalue())
+        response = self.client.get(f"/export/{name}")
+        self.assertEqual(
+            b"".join(response.streaming_content), b'{"unit1": {"typeA": 3}}'
+        )
+
+    def test_export_cors_same_as_api(self):
+        self.rebuild()
+        name = current_export_name()
+        allowed = settings.CORS_ALLOWED_ORIGINS[0]
+        for url in ["/export/devices.json", f"/export/{name}"]:
+            with self.subTest(url=url):
+                response = self.client.get(url, headers={"Origin": allowed})
+                self.assertEqual(
+                    response.headers["Access-Control-Allow-Origin"], allowed
+                )
+                response = self.client.get(
+                    url, headers={"Origin": "https://example.com"}
+                )
+                self.assertNotIn("Access-Control-Allow-Origin", response.headers)
+
+    def test_export_compressed_variant(self):
+        # Compressed variants are only kept if smaller, so export something larger.
+        name = export_devices(
+            json.dumps({f"unit{i}": {"typeA": i} for i in range(100)}).encode()
+        )
+        response = self.client.get(
+            f"/export/{name}", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        body = gzip.decompress(b"".join(response.streaming_content))
+        self.assertEqual(json.loads(body)["unit99"], {"typeA": 99})
+
+    def test_export_changes_version(self):
+        self.rebuild()
+        first = current_export_name()
+        Item.objects.create(set=Set.objects.get(alma_set_id="set1"), barcode="new")
+        self.rebuild()
+        second = current_export_name()
+        self.assertNotEqual(first, second)
+        # Earlier versions are still served, for clients which were redirected to them.
+        self.assertEqual(self.client.get(f"/export/{first}").status_code, 200)
+
+    def test_old_versions_removed(self):
+        for i in range(EXPORT_VERSIONS_KEPT + 2):
+            export_devices(f'{{"unit{i}": {{}}}}'.encode())
+        files = os.listdir(settings.DEVICES_EXPORT_DIR)
+        versions = [name for name in files if name.endswith(".json")]
+        self.assertEqual(len(versions), EXPORT_VERSIONS_KEPT)
+        self.assertFalse([name for name in files if name.endswith(".tmp")])
+
+    def test_export_not_found(self):
+        self.assertEqual(self.client.get("/export/devices.json").status_code, 404)
+        self.rebuild()
+        for path in [
+            "/export/devices.latest",
+            f"/export/{current_export_name()}.gz",
+            "/export/devices.000000000000.json",
+            "/export/../manage.py",
+        ]:
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+
+    def test_retrieve_sets_exports_if_missing(self):
+        # Every set fails, so nothing is synced, but there's no export yet.
+        with (
+            self.captureOnCommitCallbacks(execute=True),
+            self.assertLogs("clicc_devices.management.commands.retrieve_sets"),
+        ):
+            call_command(
+                "retrieve_sets", client="fake", error_rate=1, stdout=StringIO()
+            )
+        self.assertIsNotNone(current_export_name())
+
+
+class CompressionTests(DevicesCacheTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Enough units for the /devices/ payload to be worth compressing.
+        DeviceSummary.objects.bulk_create(
+            DeviceSummary(
+                unit=f"unit{i}", item_type="typeA", item_count=i, built=timezone.now()
+            )
+            for i in range(200)
+        )
+
+    def test_negotiate_encoding(self):
+        for accept_encoding, expected in [
+            ("gzip, deflate", "gzip"),
+            ("gzip;q=0.5, br;q=1.0", ENCODINGS[0]),
+            ("gzip;q=0", None),
+            ("*", ENCODINGS[0]),
+            ("*, gzip;q=0", "br" if "br" in ENCODINGS else None),
+            ("identity", None),
+            ("", None),
+        ]:
+            self.assertEqual(negotiate_encoding(accept_encoding), expected)
+
+    def test_devices_served_precompressed(self):
+        self.client.get("/devices/")
+        # The cached payload is compressed already; no compression per request.
+        with mock.patch("clicc_devices.middleware.compress") as mock_compress:
+            response = self.client.get("/devices/", headers={"Accept-Encoding": "gzip"})
+        mock_compress.assert_not_called()
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertTrue(response.headers["ETag"].startswith('W/"'))
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data["unit199"], {"typeA": 199})
+        # The weak ETag still matches.
+        response = self.client.get(
+            "/devices/",
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_revalidate_compressed_devices(self):
+        headers = {"Accept-Encoding": "gzip"}
+        response = self.client.get("/devices/", headers=headers)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.client.get(
+            "/devices/", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        # Uncompressed, the same representation has the strong ETag.
+        response = self.client.get("/devices/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag[2:])
+
+    def test_revalidate_uncompressed_small_devices(self):
+        # Under COMPRESSION_MIN_BYTES, so sent uncompressed with a strong ETag,
+        # even to a client which accepts gzip; the 304 must match it.
+        headers = {"Accept-Encoding": "gzip"}
+        response = self.client.get("/devices/", {"unit": "unit1"}, headers=headers)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        response = self.client.get(
+            "/devices/", {"unit": "unit1"}, headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = self.client.get("/devices/")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.json()["unit0"], {"typeA": 0})
+
+    def test_small_responses_not_compressed(self):
+        response = self.client.get(
+            "/devices/", {"unit": "unit1"}, headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_history_compressed_by_middleware(self):
+        DeviceCountSnapshot.objects.bulk_create(
+            DeviceCountSnapshot(
+                unit=f"unit{i}", item_type="typeA", item_count=i, taken=timezone.now()
+            )
+            for i in range(100)
+        )
+        response = self.client.get(
+            "/devices/history/", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.content))
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(data["snapshots"]), 100)
+
+    def test_pages_with_csrf_token_only_padded_gzip(self):
+        user = User.objects.create_user(username="staff", password="test")
+        self.client.force_login(user)
+        responses = [
+            self.client.get("/", headers={"Accept-Encoding": "br, gzip"})
+            for _ in range(5)
+        ]
+        for response in responses:
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        # Random padding, so the compressed length doesn't reveal the page's content.
+        self.assertGreater(len({len(response.content) for response in responses}), 1)
+
+    def test_streaming_response_compressed_per_chunk(self):
+        chunks = [f"line {i}\n".encode() * 200 for i in range(3)]
+        request = RequestFactory().get("/", headers={"Accept-Encoding": "gzip"})
+        middleware = CompressionMiddleware(
+            lambda request: StreamingHttpResponse(
+                iter(chunks), content_type="text/plain"
+            )
+        )
+        response = middleware(request)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        compressed = list(response.streaming_content)
+        # Each chunk is sent as it's compressed, plus the gzip trailer.
+        self.assertEqual(len(compressed), len(chunks) + 1)
+        decompressor = zlib.decompressobj(31)
+        self.assertEqual(decompressor.decompress(compressed[0]), chunks[0])
+        self.assertEqual(gzip.decompress(b"".join(compressed)), b"".join(chunks))
+
+    @skipUnless("br" in ENCODINGS, "brotli is not installed")
+    def test_brotli(self):
+        response = self.client.get("/devices/", headers={"Accept-Encoding": "br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(
+            json.loads(brotli.decompress(response.content))["unit5"], {"typeA": 5}
+        )
+
+
+class QueryTimingMiddlewareTests(DevicesCacheTestCase):
+    def test_server_timing_header(self):
+        response = self.client.get("/devices/")
+        # Uncached: one query for the device summary.
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="1 queries", view;dur=[\d.]+$',
+        )
+
+    def test_request_logged(self):
+        with self.assertLogs("clicc_devices.middleware", level="INFO") as logs:
+            self.client.get("/devices/")
+        self.assertIn("path=/devices/ status=200 queries=1", logs.output[0])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logs_queries(self):
+        with self.assertLogs("clicc_devices.middleware", level="WARNING") as logs:
+            self.client.get("/devices/")
+        self.assertIn("Slow request", logs.output[0])
+        self.assertIn("clicc_devices_devicesummary", logs.output[0])
+
+    def test_excluded_paths_not_logged(self):
+        with self.assertNoLogs("clicc_devices.middleware"):
+            response = self.client.get("/logs/")
+        self.assertIn("Server-Timing", response)
+
+
+class ViewSetsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="staff", password="test")
+        type_a = ItemType.objects.create(name="typeA")
+        type_b = ItemType.objects.create(name="typeB")
+        for i in range(60):
+            set_obj = Set.objects.create(
+                alma_set_id=f"set{i}",
+                name=f"Set {i:02}",
+                unit="unit1" if i % 2 else "unit2",
+                type=type_a if i % 3 else type_b,
+                retrieved=timezone.now(),
+            )
+            for j in range(i % 4):
+                Item.objects.create(set=set_obj, barcode=f"barcode_{i}_{j}")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_query_count_does_not_depend_on_set_count(self):
+        # Session and user, page count, page of sets, units and item types.
+        with self.assertNumQueries(6):
+            response = self.client.get("/")
+        self.assertEqual(len(response.context["page"]), views.SETS_PER_PAGE)
+
+    def test_item_counts_are_annotated(self):
+        response = self.client.get("/", {"sort": "name"})
+        first = response.context["page"][0]
+        self.assertEqual(first.name, "Set 00")
+        self.assertEqual(first.item_count, 0)
+        self.assertEqual(response.context["page"][3].item_count, 3)
+
+    def test_second_page(self):
+        response = self.client.get("/", {"page": 2})
+        self.assertEqual(len(response.context["page"]), 60 - views.SETS_PER_PAGE)
+
+    def test_filter_by_unit_and_type(self):
+        response = self.client.get("/", {"unit": "unit1", "type": "typeB"})
+        sets = list(response.context["page"])
+        # Odd numbers which are multiples of 3: 3, 9, 15, ... 57.
+        self.assertEqual(len(sets), 10)
+        self.assertTrue(all(s.unit == "unit1" and s.type.name == "typeB" for s in sets))
+
+    def test_sort_descending_by_item_count(self):
+        response = self.client.get("/", {"sort": "-item_count"})
+        counts = [s.item_count for s in response.context["page"]]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+    def test_invalid_sort_uses_default(self):
+        response = self.client.get("/", {"sort": "barcode"})
+        self.assertEqual(response.context["selected_sort"], "name")
+
+
+class ConditionalDevicesTests(DevicesCacheTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        set1 = Set.objects.create(
+            alma_set_id="set1",
+            name="Set 1",
+            unit="unit1",
+            type=item_type,
+            retrieved=timezone.now(),
+        )
+        Item.objects.create(set=set1, barcode="barcode_1")
+        rebuild_device_summary()
+
+    def test_response_has_validators(self):
+        response = self.client.get("/devices/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response.headers)
+        self.assertIn("Last-Modified", response.headers)
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get("/devices/").headers["ETag"]
+        # The cached response has everything needed, no data is read.
+        with self.assertNumQueries(0):
+            response = self.client.get("/devices/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.client.get("/devices/").headers["Last-Modified"]
+        response = self.client.get(
+            "/devices/", headers={"If-Modified-Since": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_rebuild_changes_etag(self):
+        etag = self.client.get("/devices/").headers["ETag"]
+        Item.objects.create(set=Set.objects.get(alma_set_id="set1"), barcode="new")
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+        response = self.client.get("/devices/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_rebuild_with_same_data_keeps_etag(self):
+        # The ETag reflects the content, so clients don't refetch unchanged data.
+        etag = self.client.get("/devices/").headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_device_summary()
+        response = self.client.get("/devices/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_hits_and_misses(self):
+        first = self.client.get("/devices/")
+        second = self.client.get("/devices/")
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(devices_cache_totals(), {"hits": 1, "misses": 1})
+        self.assertIn(
+            'clicc_devices_devices_cache_requests_total{result="hit"} 1',
+            render_metrics(),
+        )
+
+    def test_cache_stats_requires_login(self):
+        response = self.client.get("/devices/cache_stats/")
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.create_user(username="staff", password="test")
+        self.client.force_login(user)
+        response = self.client.get("/devices/cache_stats/")
+        self.assertEqual(set(response.json()), {"hits", "misses"})
+
+    def test_not_modified_keeps_cors_headers(self):
+        prod_origin = "https://www.library.ucla.edu"
+        etag = self.client.get("/devices/").headers["ETag"]
+        response = self.client.get(
+            "/devices/", headers={"Origin": prod_origin, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            response.headers.get("access-control-allow-origin"), prod_origin
+        )
 
-class CORSHeadersTests(TestCase):
+
+class CORSHeadersTests(DevicesCacheTestCase):
     def test_valid_prod_origin(self):
         # Add production website origin header to request
         prod_origin = "https://www.library.ucla.edu"
@@ -131,3 +793,1065 @@ class CORSHeadersTests(TestCase):
         # since the Origin header is not in our allowed values.
         unexpected_header = "access-control-allow-origin"
         self.assertNotIn(unexpected_header, response.headers)
+
+
+def fake_alma_set(barcodes):
+    # Minimal stand-in for the set returned by AlmaSetMembersClient.get_set().
+    return SimpleNamespace(
+        members=[SimpleNamespace(description=barcode) for barcode in barcodes]
+    )
+
+
+class RetrievalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        cls.set_obj = Set.objects.create(
+            alma_set_id="set1",
+            name="Set 1",
+            unit="unit1",
+            type=item_type,
+            retrieved=timezone.now(),
+        )
+        for i in range(3):
+            Item.objects.create(set=cls.set_obj, barcode=f"old_{i}")
+
+    def test_sync_set_items(self):
+        changes = sync_set_items(self.set_obj, ["old_1", "old_2", "new_1", "new_2"])
+        self.assertEqual(changes, {"added": 2, "removed": 1, "unchanged": 2})
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"old_1", "old_2", "new_1", "new_2"})
+
+    def test_sync_set_items_keeps_unchanged_items(self):
+        unchanged_pks = set(self.set_obj.items.values_list("pk", flat=True))
+        sync_set_items(self.set_obj, ["old_0", "old_1", "old_2", "new_1"])
+        self.assertTrue(
+            unchanged_pks <= set(self.set_obj.items.values_list("pk", flat=True))
+        )
+
+    def test_sync_without_changes_only_reads(self):
+        # Savepoint, select existing barcodes, update retrieved, release savepoint.
+        with self.assertNumQueries(4):
+            changes = sync_set_items(self.set_obj, ["old_0", "old_1", "old_2"])
+        self.assertEqual(changes, {"added": 0, "removed": 0, "unchanged": 3})
+
+    def test_sync_set_items_writes_in_batches(self):
+        barcodes = [f"new_{i}" for i in range(25)]
+        # Savepoint, select, 1 delete, 3 inserts, update retrieved, release savepoint.
+        with self.assertNumQueries(8):
+            sync_set_items(self.set_obj, barcodes, batch_size=10)
+        self.assertEqual(self.set_obj.items.count(), 25)
+
+    def test_failure_leaves_set_unchanged(self):
+        def failing_barcodes():
+            yield "new_1"
+            raise RuntimeError("Connection lost")
+
+        with self.assertRaises(RuntimeError):
+            sync_set_items(self.set_obj, failing_barcodes(), batch_size=1)
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"old_0", "old_1", "old_2"})
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    @mock.patch("clicc_devices.management.commands.retrieve_sets.AlmaSetMembersClient")
+    def test_retrieve_sets_command(self, mock_client):
+        mock_client.return_value.get_set.return_value = fake_alma_set(
+            ["b1", "b2", "b3", "b4"]
+        )
+        with self.assertLogs(
+            "clicc_devices.management.commands.retrieve_sets", level="INFO"
+        ) as logs:
+            call_command("retrieve_sets", batch_size=2)
+        self.assertEqual(self.set_obj.items.count(), 4)
+        self.assertTrue(any("items/second" in line for line in logs.output))
+        self.assertEqual(DeviceSummary.objects.get(unit="unit1").item_count, 4)
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    @mock.patch("clicc_devices.management.commands.retrieve_sets.AlmaSetMembersClient")
+    def test_retrieve_sets_command_reports_failures(self, mock_client):
+        mock_client.return_value.get_set.side_effect = AlmaRequestError(
+            ["Set not found"]
+        )
+        with self.assertLogs(
+            "clicc_devices.management.commands.retrieve_sets", level="ERROR"
+        ) as logs:
+            call_command("retrieve_sets")
+        self.assertIn("Set not found", logs.output[0])
+        self.assertEqual(self.set_obj.items.count(), 3)
+
+    def test_stage_and_apply_set_items(self):
+        pages = iter([["old_1", "old_2"], ["new_1", "new_2"], ["new_2"]])
+        staged = stage_set_items(self.set_obj, pages, batch_size=1)
+        self.assertEqual(staged, 5)
+        changes = apply_staged_items(self.set_obj)
+        self.assertEqual(changes, {"added": 2, "removed": 1, "unchanged": 2})
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"old_1", "old_2", "new_1", "new_2"})
+        # Staged barcodes are only kept until they've been applied.
+        self.assertFalse(StagedItem.objects.exists())
+
+    def test_stage_set_items_clears_leftovers(self):
+        StagedItem.objects.create(set=self.set_obj, barcode="interrupted")
+        stage_set_items(self.set_obj, [["old_0"]])
+        apply_staged_items(self.set_obj)
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"old_0"})
+
+    @skipUnless(copy_supported(), "COPY requires PostgreSQL")
+    def test_stage_set_items_with_copy(self):
+        pages = iter([["old_1", "new_1"], ["new_2"]])
+        staged = stage_set_items(self.set_obj, pages, use_copy=True)
+        self.assertEqual(staged, 3)
+        changes = apply_staged_items(self.set_obj)
+        self.assertEqual(changes, {"added": 2, "removed": 2, "unchanged": 1})
+
+    @skipIf(copy_supported(), "COPY is supported by this database")
+    @override_settings(ALMA_API_KEY="test")
+    def test_copy_loader_requires_postgresql(self):
+        with self.assertLogs(
+            "clicc_devices.management.commands.retrieve_sets", level="ERROR"
+        ) as logs:
+            call_command("retrieve_sets", loader="copy")
+        self.assertIn("requires a PostgreSQL database", logs.output[0])
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    @mock.patch("clicc_devices.management.commands.retrieve_sets.AlmaSetMembersClient")
+    def test_retrieve_sets_command_streaming(self, mock_client):
+        mock_client.return_value.iter_member_pages.return_value = iter(
+            [["old_0", "b1"], ["b2"]]
+        )
+        with self.assertLogs(
+            "clicc_devices.management.commands.retrieve_sets", level="INFO"
+        ) as logs:
+            call_command("retrieve_sets", stream=True, report_memory=True)
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"old_0", "b1", "b2"})
+        self.assertTrue(any("Peak memory" in line for line in logs.output))
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    @mock.patch("clicc_devices.management.commands.retrieve_sets.AlmaSetMembersClient")
+    def test_retrieve_sets_changed_only(self, mock_client):
+        mock_client.return_value.get_set_fingerprint.return_value = "abc"
+        mock_client.return_value.get_set.return_value = fake_alma_set(["b1"])
+        # No fingerprint stored yet, so the set is retrieved and its fingerprint saved.
+        call_command("retrieve_sets", changed_only=True)
+        self.set_obj.refresh_from_db()
+        self.assertEqual(self.set_obj.alma_fingerprint, "abc")
+        self.assertEqual(mock_client.return_value.get_set.call_count, 1)
+        # Same fingerprint: the set's members are not requested again.
+        with self.assertLogs(
+            "clicc_devices.management.commands.retrieve_sets", level="INFO"
+        ) as logs:
+            call_command("retrieve_sets", changed_only=True)
+        self.assertEqual(mock_client.return_value.get_set.call_count, 1)
+        self.assertTrue(any("Skipped set" in line for line in logs.output))
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    def test_connection_error_fails_only_that_set(self):
+        Set.objects.create(
+            alma_set_id="set2",
+            name="Set 2",
+            unit="unit2",
+            type=self.set_obj.type,
+            retrieved=timezone.now(),
+        )
+
+        def get(url, params, timeout):
+            if "/set1/" in url:
+                raise requests.ConnectionError("Connection reset")
+            return mock.Mock(
+                ok=True,
+                json=mock.Mock(
+                    return_value={
+                        "member": [{"description": "b1"}],
+                        "total_record_count": 1,
+                    }
+                ),
+            )
+
+        with mock.patch("clicc_devices.alma.requests.Session.get", side_effect=get):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertLogs(
+                    "clicc_devices.management.commands.retrieve_sets", level="ERROR"
+                ):
+                    call_command("retrieve_sets")
+        self.assertEqual(
+            list(Set.objects.get(alma_set_id="set2").items.values_list("barcode")),
+            [("b1",)],
+        )
+        self.assertEqual(self.set_obj.items.count(), 3)
+        self.assertEqual(DeviceSummary.objects.get(unit="unit2").item_count, 1)
+        run = RetrievalRun.objects.get()
+        self.assertIsNotNone(run.finished)
+        self.assertEqual((run.sets_synced, run.sets_failed), (1, 1))
+
+    @override_settings(ALMA_API_KEY=None, CACHES=TEST_CACHES)
+    def test_retrieve_sets_fake_client(self):
+        # No API key or network access needed.
+        call_command("retrieve_sets", client="fake", fake_items_per_set=5)
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {f"set1-I{i:07}" for i in range(5)})
+
+    @override_settings(ALMA_API_KEY=None, CACHES=TEST_CACHES)
+    def test_retrieve_sets_fake_client_churn_between_runs(self):
+        options = {"client": "fake", "fake_items_per_set": 20, "fake_churn": 0.25}
+        call_command("retrieve_sets", **options)
+        first = set(self.set_obj.items.values_list("barcode", flat=True))
+        call_command("retrieve_sets", **options)
+        second = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(len(second), 20)
+        self.assertNotEqual(first, second)
+
+    @override_settings(ALMA_API_KEY="test", CACHES=TEST_CACHES)
+    @mock.patch("clicc_devices.management.commands.retrieve_sets.AlmaSetMembersClient")
+    def test_retrieve_sets_record_and_replay(self, mock_client):
+        mock_client.return_value.get_set.return_value = fake_alma_set(["b1", "b2"])
+        with tempfile.TemporaryDirectory() as recording_dir:
+            call_command("retrieve_sets", client="record", recording_dir=recording_dir)
+            self.set_obj.items.all().delete()
+            mock_client.reset_mock()
+            call_command("retrieve_sets", client="replay", recording_dir=recording_dir)
+        mock_client.return_value.get_set.assert_not_called()
+        barcodes = set(self.set_obj.items.values_list("barcode", flat=True))
+        self.assertEqual(barcodes, {"b1", "b2"})
+
+    @override_settings(ALMA_API_KEY=None)
+    def test_retrieve_sets_replay_without_recording(self):
+        with tempfile.TemporaryDirectory() as recording_dir:
+            with self.assertLogs(
+                "clicc_devices.management.commands.retrieve_sets", level="ERROR"
+            ) as logs:
+                call_command(
+                    "retrieve_sets", client="replay", recording_dir=recording_dir
+                )
+        self.assertIn("No recording of set set1", logs.output[0])
+        self.assertEqual(self.set_obj.items.count(), 3)
+
+
+class OfflineAlmaClientTests(SimpleTestCase):
+    def test_fake_client_churn(self):
+        before = FakeAlmaClient(items_per_set=10).set_barcodes("s")
+        after = FakeAlmaClient(items_per_set=10, churn=0.3).set_barcodes("s")
+        self.assertEqual(len(after), 10)
+        self.assertEqual(len(set(before) - set(after)), 3)
+        # Repeatable within a run, and different from the next run.
+        self.assertEqual(
+            FakeAlmaClient(items_per_set=10, churn=0.3).set_barcodes("s"), after
+        )
+        next_run = FakeAlmaClient(items_per_set=10, churn=0.3, run=1).set_barcodes("s")
+        self.assertEqual(len(set(before) - set(next_run)), 3)
+        self.assertNotEqual(set(next_run), set(after))
+
+    def test_fake_client_pages(self):
+        client = FakeAlmaClient(items_per_set=250)
+        pages = list(client.iter_member_pages("s", page_size=100))
+        self.assertEqual([len(page) for page in pages], [100, 100, 50])
+        self.assertEqual(len(client.get_set("s").members), 250)
+
+    def test_latency_per_simulated_request(self):
+        client = FakeAlmaClient(items_per_set=250, latency=0.01, page_size=100)
+        with mock.patch("clicc_devices.alma_offline.time.sleep") as sleep:
+            client.get_set("s")
+        # 3 pages of up to 100 members.
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_error_rate(self):
+        client = FakeAlmaClient(items_per_set=10, error_rate=0.5, seed=1)
+        errors = 0
+        for _ in range(200):
+            try:
+                client.get_set_fingerprint("s")
+            except AlmaRequestError:
+                errors += 1
+        self.assertTrue(50 < errors < 150)
+        with self.assertRaises(AlmaRequestError):
+            FakeAlmaClient(error_rate=1).get_set("s")
+
+    def test_record_streamed_pages_and_fingerprint(self):
+        members_client = FakeAlmaClient(items_per_set=5)
+        with tempfile.TemporaryDirectory() as recording_dir:
+            recorder = RecordingAlmaClient(members_client, recording_dir)
+            fingerprint = recorder.get_set_fingerprint("s")
+            pages = list(recorder.iter_member_pages("s", page_size=2))
+            replay = ReplayAlmaClient(recording_dir)
+            self.assertEqual(list(replay.iter_member_pages("s", page_size=2)), pages)
+            self.assertEqual(replay.get_set_fingerprint("s"), fingerprint)
+
+    def test_concurrent_recordings_of_one_set(self):
+        members_client = FakeAlmaClient(items_per_set=5)
+        with tempfile.TemporaryDirectory() as recording_dir:
+            recorder = RecordingAlmaClient(members_client, recording_dir)
+            # Each write has its own temporary file, so none fails or is lost.
+            results = list(run_concurrently(recorder.get_set, ["s"] * 8, workers=8))
+            self.assertEqual(len(results), 8)
+            self.assertEqual(os.listdir(recording_dir), ["s.json"])
+            replay = ReplayAlmaClient(recording_dir)
+            self.assertEqual(len(replay.get_set("s").members), 5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsTests(TestCase):
+    def setUp(self):
+        # Discard counts from earlier tests; rolled back after each test.
+        metrics.flush()
+        MetricSample.objects.all().delete()
+
+    def test_counters_from_several_processes_are_added(self):
+        # Two instances stand in for two processes.
+        for process_metrics in [Metrics(), Metrics()]:
+            process_metrics.increment("clicc_devices_items_synced_total", 1000)
+            process_metrics.flush()
+        self.assertIn("\nclicc_devices_items_synced_total 2000\n", render_metrics())
+
+    def test_histogram(self):
+        process_metrics = Metrics()
+        for duration in [0.003, 0.2, 20]:
+            process_metrics.observe(
+                "clicc_devices_alma_request_duration_seconds", duration
+            )
+        process_metrics.flush()
+        lines = [
+            line
+            for line in render_metrics().splitlines()
+            if line.startswith("clicc_devices_alma_request_duration_seconds")
+        ]
+        self.assertEqual(
+            lines[0], 'clicc_devices_alma_request_duration_seconds_bucket{le="0.005"} 1'
+        )
+        self.assertIn(
+            'clicc_devices_alma_request_duration_seconds_bucket{le="0.25"} 2', lines
+        )
+        # Buckets in increasing order, ending with +Inf, then count and sum.
+        self.assertEqual(
+            lines[-3:],
+            [
+                'clicc_devices_alma_request_duration_seconds_bucket{le="+Inf"} 3',
+                "clicc_devices_alma_request_duration_seconds_count 3",
+                "clicc_devices_alma_request_duration_seconds_sum 20.203",
+            ],
+        )
+
+    def test_gauge(self):
+        process_metrics = Metrics()
+        for value in [5, 7]:
+            process_metrics.set("clicc_devices_retrieval_last_duration_seconds", value)
+            process_metrics.flush()
+        self.assertIn(
+            "\nclicc_devices_retrieval_last_duration_seconds 7\n", render_metrics()
+        )
+
+    def test_metrics_endpoint_counts_requests(self):
+        self.client.get("/devices/")
+        response = self.client.get("/metrics/")
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'clicc_devices_http_requests_total{status="200",view="devices"} 1',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_endpoint_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+        response = self.client.get(
+            "/metrics/", headers={"Authorization": "Bearer secret"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_sets_metrics(self):
+        item_type = ItemType.objects.create(name="typeA")
+        Set.objects.create(
+            alma_set_id="set1",
+            name="Set 1",
+            unit="unit1",
+            type=item_type,
+            retrieved=timezone.now(),
+        )
+        call_command("retrieve_sets", client="fake", fake_items_per_set=5)
+        # retrieve_sets saves its metrics itself, before exiting.
+        output = render_metrics()
+        self.assertIn('clicc_devices_sets_retrieved_total{result="synced"} 1', output)
+        self.assertIn("clicc_devices_items_synced_total 5", output)
+        self.assertIn('clicc_devices_item_changes_total{change="added"} 5', output)
+        self.assertIn("clicc_devices_set_sync_duration_seconds_count 1", output)
+        self.assertIn("clicc_devices_retrieval_runs_total 1", output)
+
+
+@override_settings(CACHES=TEST_CACHES, ALMA_API_KEY=None)
+class RetrievalHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        for i in range(3):
+            Set.objects.create(
+                alma_set_id=f"set{i}",
+                name=f"Set {i}",
+                unit="unit1",
+                type=item_type,
+                retrieved=timezone.now(),
+            )
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+
+    def test_retrieve_sets_records_run(self):
+        call_command("retrieve_sets", client="fake", fake_items_per_set=5, workers=1)
+        run = RetrievalRun.objects.get()
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(run.sets_synced, 3)
+        self.assertEqual(run.options, "--workers 1 --client fake --loader auto")
+        retrieval = run.set_retrievals.get(alma_set_id="set0")
+        self.assertEqual(retrieval.result, "synced")
+        self.assertEqual((retrieval.added, retrieval.removed), (5, 0))
+        self.assertIsNotNone(retrieval.alma_seconds)
+        self.assertIsNotNone(retrieval.write_seconds)
+
+    def test_retrieve_sets_records_failures(self):
+        with tempfile.TemporaryDirectory() as recording_dir:
+            with self.assertLogs(
+                "clicc_devices.management.commands.retrieve_sets", level="ERROR"
+            ):
+                call_command(
+                    "retrieve_sets", client="replay", recording_dir=recording_dir
+                )
+        run = RetrievalRun.objects.get()
+        self.assertEqual(run.sets_failed, 3)
+        self.assertEqual(
+            run.set_retrievals.get(alma_set_id="set1").error,
+            "No recording of set set1",
+        )
+
+    def test_dashboard_requires_staff(self):
+        self.client.force_login(User.objects.create_user("not_staff"))
+        response = self.client.get("/retrievals/")
+        self.assertEqual(response.status_code, 302)
+
+    def test_dashboard(self):
+        run = RetrievalRun.objects.create(
+            started=timezone.now(), finished=timezone.now()
+        )
+        for i, seconds in enumerate([1, 2, 3, 4, 50]):
+            SetRetrieval.objects.create(
+                run=run,
+                alma_set_id=f"set{i}",
+                name=f"Set {i}",
+                started=timezone.now(),
+                result="synced",
+                alma_seconds=seconds,
+                write_seconds=1,
+                added=1,
+            )
+        self.client.force_login(self.staff)
+        response = self.client.get("/retrievals/")
+        self.assertEqual(response.context["run"], run)
+        self.assertEqual(response.context["runs"][0].added, 5)
+        self.assertEqual(response.context["slowest_sets"][0].alma_set_id, "set4")
+        label, durations = response.context["set_durations"][0]
+        self.assertEqual((label, durations["p50"]), ("Alma", 3))
+        self.assertGreater(durations["p95"], 40)
+        response = self.client.get(f"/retrievals/{run.pk + 1}/")
+        self.assertEqual(response.status_code, 404)
+
+
+class BarcodeLookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        for i in range(2):
+            set_obj = Set.objects.create(
+                alma_set_id=f"set{i}",
+                name=f"Set {i}",
+                unit=f"unit{i}",
+                type=item_type,
+                retrieved=timezone.now(),
+            )
+            Item.objects.create(set=set_obj, barcode=f"only_in_{i}")
+            Item.objects.create(set=set_obj, barcode="in_both")
+
+    def test_barcode_lookup(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/devices/barcode/only_in_1/")
+        self.assertEqual(
+            response.json(),
+            {
+                "barcode": "only_in_1",
+                "items": [
+                    {
+                        "set": "Set 1",
+                        "alma_set_id": "set1",
+                        "unit": "unit1",
+                        "item_type": "typeA",
+                    }
+                ],
+            },
+        )
+
+    def test_barcode_in_several_sets(self):
+        items = self.client.get("/devices/barcode/in_both/").json()["items"]
+        self.assertEqual([item["unit"] for item in items], ["unit0", "unit1"])
+
+    def test_barcode_not_found(self):
+        response = self.client.get("/devices/barcode/unknown/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_barcode_lookup(self):
+        barcodes = ["only_in_0", "in_both", "unknown"] + [f"b{i}" for i in range(2000)]
+        # One query, however many barcodes; no CSRF token needed.
+        client = Client(enforce_csrf_checks=True)
+        with self.assertNumQueries(1):
+            response = client.post(
+                "/devices/barcode/",
+                {"barcodes": barcodes},
+                content_type="application/json",
+            )
+        data = response.json()
+        self.assertEqual(set(data["results"]), {"only_in_0", "in_both"})
+        self.assertEqual(len(data["results"]["in_both"]), 2)
+        self.assertEqual(len(data["not_found"]), 2001)
+
+    def test_bulk_barcode_lookup_invalid(self):
+        for body in [
+            "not json",
+            {"barcode": ["b1"]},
+            {"barcodes": "b1"},
+            {"barcodes": [1, 2]},
+            {"barcodes": ["b"] * (views.MAX_BULK_BARCODES + 1)},
+        ]:
+            response = self.client.post(
+                "/devices/barcode/", body, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_barcode_lookup_uses_index(self):
+        plans, failures = check_query_plans()
+        self.assertNotIn("Items by barcode (barcode lookup)", failures)
+
+
+class DeviceHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        type_a = ItemType.objects.create(name="typeA")
+        type_b = ItemType.objects.create(name="typeB")
+        for unit, item_type in [
+            ("unit1", type_a),
+            ("unit1", type_b),
+            ("unit2", type_a),
+        ]:
+            Set.objects.create(
+                alma_set_id=f"{unit}-{item_type.name}",
+                name=f"{unit} {item_type.name}",
+                unit=unit,
+                type=item_type,
+                retrieved=timezone.now(),
+            )
+        # Three days of snapshots, at noon local time.
+        cls.days = [
+            timezone.make_aware(datetime(2026, 7, day, 12)) for day in [1, 2, 3]
+        ]
+        DeviceCountSnapshot.objects.bulk_create(
+            DeviceCountSnapshot(
+                unit=unit, item_type=item_type, item_count=count, taken=taken
+            )
+            for count, taken in enumerate(cls.days)
+            for unit, item_type in [
+                ("unit1", "typeA"),
+                ("unit1", "typeB"),
+                ("unit2", "typeA"),
+            ]
+        )
+
+    def get_history(self, **params):
+        response = self.client.get("/devices/history/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_all_history(self):
+        data = self.get_history()
+        self.assertEqual(len(data["snapshots"]), 9)
+        self.assertFalse(data["truncated"])
+        first = data["snapshots"][0]
+        self.assertEqual(
+            first,
+            {
+                "unit": "unit1",
+                "item_type": "typeA",
+                "taken": "2026-07-01T19:00:00Z",
+                "item_count": 0,
+            },
+        )
+
+    def test_filter_by_unit_and_type(self):
+        data = self.get_history(unit="unit1", type="typeB")
+        self.assertEqual(
+            [snapshot["item_count"] for snapshot in data["snapshots"]], [0, 1, 2]
+        )
+        self.assertEqual(
+            {(s["unit"], s["item_type"]) for s in data["snapshots"]},
+            {("unit1", "typeB")},
+        )
+
+    def test_time_range(self):
+        # A date-only "to" includes the whole day.
+        data = self.get_history(
+            unit="unit2", **{"from": "2026-07-02", "to": "2026-07-02"}
+        )
+        self.assertEqual([s["item_count"] for s in data["snapshots"]], [1])
+        data = self.get_history(**{"from": "2026-07-02T12:00"})
+        self.assertEqual(len(data["snapshots"]), 6)
+        data = self.get_history(**{"to": "2026-07-02T11:59:59"})
+        self.assertEqual(len(data["snapshots"]), 3)
+
+    def test_invalid_time(self):
+        for params in [{"from": "yesterday"}, {"to": "2026-13-01"}]:
+            response = self.client.get("/devices/history/", params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_truncated(self):
+        with mock.patch.object(views, "MAX_HISTORY_ROWS", 4):
+            data = self.get_history()
+        self.assertEqual(len(data["snapshots"]), 4)
+        self.assertTrue(data["truncated"])
+
+    def test_snapshot_device_counts(self):
+        rebuild_device_summary()
+        DeviceCountSnapshot.objects.all().delete()
+        Item.objects.create(set=Set.objects.get(alma_set_id="unit1-typeA"), barcode="1")
+        rebuild_device_summary()
+        self.assertEqual(snapshot_device_counts(), 3)
+        snapshots = DeviceCountSnapshot.objects.order_by("unit", "item_type")
+        self.assertEqual(
+            [(s.unit, s.item_type, s.item_count) for s in snapshots],
+            [("unit1", "typeA", 1), ("unit1", "typeB", 0), ("unit2", "typeA", 0)],
+        )
+        # One time for the whole snapshot, so it can be grouped.
+        self.assertEqual(len({s.taken for s in snapshots}), 1)
+
+    def test_retrieve_sets_takes_snapshot(self):
+        DeviceCountSnapshot.objects.all().delete()
+        call_command(
+            "retrieve_sets", client="fake", fake_items_per_set=5, stdout=StringIO()
+        )
+        call_command(
+            "retrieve_sets", client="fake", fake_items_per_set=5, stdout=StringIO()
+        )
+        self.assertEqual(DeviceCountSnapshot.objects.count(), 6)
+        latest = DeviceCountSnapshot.objects.latest("taken").taken
+        self.assertLess(timezone.now() - latest, timedelta(minutes=1))
+        self.assertEqual(
+            set(
+                DeviceCountSnapshot.objects.filter(taken=latest).values_list(
+                    "item_count", flat=True
+                )
+            ),
+            {5},
+        )
+
+    def test_history_uses_index(self):
+        plans, failures = check_query_plans()
+        self.assertNotIn("Device count history (/devices/history/)", failures)
+
+
+class IndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item_type = ItemType.objects.create(name="typeA")
+        for i in range(20):
+            set_obj = Set.objects.create(
+                alma_set_id=f"set{i}",
+                name=f"Set {i}",
+                unit=f"unit{i % 4}",
+                type=item_type,
+                retrieved=timezone.now(),
+            )
+            Item.objects.bulk_create(
+                Item(set=set_obj, barcode=f"barcode_{i}_{j}") for j in range(50)
+            )
+        rebuild_device_summary()
+
+    def test_main_queries_use_indexes(self):
+        plans, failures = check_query_plans()
+        self.assertEqual(failures, [], plans)
+
+    def test_check_query_plans_command(self):
+        output = StringIO()
+        call_command("check_query_plans", stdout=output)
+        self.assertNotIn("NO INDEX", output.getvalue())
+
+    def test_unsupported_database_skipped(self):
+        with mock.patch.dict(query_plans.INDEX_SCAN_PATTERNS, clear=True):
+            with self.assertLogs("clicc_devices.query_plans", level="WARNING"):
+                self.assertEqual(check_query_plans(), ({}, []))
+            output = StringIO()
+            with self.assertLogs("clicc_devices.query_plans", level="WARNING"):
+                call_command("check_query_plans", stdout=output)
+        self.assertIn("SKIPPED", output.getvalue())
+
+    def test_barcodes_are_unique_within_a_set(self):
+        set_obj = Set.objects.get(alma_set_id="set1")
+        with self.assertRaises(IntegrityError):
+            Item.objects.create(set=set_obj, barcode="barcode_1_1")
+
+
+class LogReaderTests(SimpleTestCase):
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.log_dir.name, "application.log")
+        with open(self.log_file, "w") as f:
+            for i in range(1000):
+                f.write(f"INFO line {i}\n")
+
+    def tearDown(self):
+        self.log_dir.cleanup()
+
+    def test_tail_lines(self):
+        # Small blocks, so lines span block boundaries.
+        lines = tail_lines(self.log_file, 3, block_size=7)
+        self.assertEqual(
+            lines, ["INFO line 997\n", "INFO line 998\n", "INFO line 999\n"]
+        )
+
+    def test_tail_lines_more_than_file(self):
+        lines = tail_lines(self.log_file, 5000)
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines[0], "INFO line 0\n")
+
+    def test_tail_lines_without_final_newline(self):
+        with open(self.log_file, "a") as f:
+            f.write("partial")
+        self.assertEqual(tail_lines(self.log_file, 2), ["INFO line 999\n", "partial"])
+
+    def test_tail_lines_reads_only_the_end(self):
+        with mock.patch("builtins.open", mock.mock_open(read_data=b"")) as mock_file:
+            mock_file.return_value.seek.return_value = 10_000_000
+            mock_file.return_value.read.return_value = b"line\n" * 100
+            tail_lines(self.log_file, 10, block_size=500)
+        mock_file.return_value.read.assert_called_once_with(500)
+
+    def test_read_new_lines(self):
+        _, cursor = tail_lines_with_cursor(self.log_file, 10)
+        with open(self.log_file, "a") as f:
+            f.write("INFO new 1\nINFO new 2\nINFO par")
+        lines, cursor, reset = read_new_lines(self.log_file, cursor)
+        self.assertEqual(lines, ["INFO new 1\n", "INFO new 2\n"])
+        self.assertFalse(reset)
+        # The incomplete line is returned once it's finished.
+        with open(self.log_file, "a") as f:
+            f.write("tial\n")
+        lines, _, _ = read_new_lines(self.log_file, cursor)
+        self.assertEqual(lines, ["INFO partial\n"])
+
+    def test_read_new_lines_limits_bytes(self):
+        inode = os.stat(self.log_file).st_ino
+        lines, cursor, _ = read_new_lines(
+            self.log_file, format_cursor(inode, 0), max_bytes=100
+        )
+        _, offset = parse_cursor(cursor)
+        self.assertLessEqual(offset, 100)
+        self.assertEqual(offset, sum(len(line) for line in lines))
+
+    def test_read_new_lines_after_truncation(self):
+        _, cursor = tail_lines_with_cursor(self.log_file, 1)
+        with open(self.log_file, "w") as f:
+            f.write("INFO restarted\n")
+        lines, _, reset = read_new_lines(self.log_file, cursor)
+        self.assertTrue(reset)
+        self.assertEqual(lines, ["INFO restarted\n"])
+
+    def test_read_new_lines_after_rotation(self):
+        # The new log has grown past the old cursor before it's next read.
+        _, cursor = tail_lines_with_cursor(self.log_file, 1)
+        size = os.path.getsize(self.log_file)
+        os.rename(self.log_file, self.log_file + ".1")
+        with open(self.log_file, "w") as f:
+            f.writelines(f"INFO rotated {i}\n" for i in range(size // 10))
+        self.assertGreater(os.path.getsize(self.log_file), size)
+        lines, _, reset = read_new_lines(self.log_file, cursor)
+        self.assertTrue(reset)
+        self.assertEqual(lines[0], "INFO rotated 0\n")
+
+    def test_read_new_lines_invalid_cursor(self):
+        for cursor in ["123", "abc:1", "1:-1", ""]:
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                read_new_lines(self.log_file, cursor)
+
+    def test_log_tail_endpoint(self):
+        with self.settings(LOG_FILE=self.log_file):
+            data = self.client.get("/logs/tail/").json()
+            self.assertEqual(len(data["lines"]), views.LOG_TAIL_LINES)
+            with open(self.log_file, "a") as f:
+                f.write("INFO new\n")
+            data = self.client.get("/logs/tail/", {"cursor": data["cursor"]}).json()
+            self.assertEqual(data["lines"], ["INFO new\n"])
+            response = self.client.get("/logs/tail/", {"cursor": "abc"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_show_log_caps_line_count(self):
+        with self.settings(LOG_FILE=self.log_file, LOG_VIEW_MAX_LINES=10):
+            response = self.client.get("/logs/1000000")
+        self.assertEqual(response.context["log_data"].count("\n"), 10)
+
+
+class LogIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.log_dir.name, "application.log")
+        self.index_dir = os.path.join(self.log_dir.name, ".index")
+        # Two rotated files and the current one, an hour of records each,
+        # with a traceback after each ERROR.
+        for path, day in [
+            (f"{self.log_file}.2", 16),
+            (f"{self.log_file}.1", 17),
+            (self.log_file, 18),
+        ]:
+            with open(path, "w") as f:
+                for minute in range(60):
+                    level = "ERROR" if minute % 20 == 0 else "INFO"
+                    f.write(
+                        f"{level} 2026-10-{day} 02:{minute:02}:00,000 "
+                        f"clicc_devices retrieve_sets record {day}-{minute}\n"
+                    )
+                    if level == "ERROR":
+                        f.write("Traceback (most recent call last):\n  ...\n")
+
+    def tearDown(self):
+        self.log_dir.cleanup()
+
+    def test_log_files_oldest_first(self):
+        self.assertEqual(
+            log_files(self.log_file),
+            [f"{self.log_file}.2", f"{self.log_file}.1", self.log_file],
+        )
+
+    def test_index_checkpoints(self):
+        with mock.patch("clicc_devices.log_index.CHECKPOINT_BYTES", 1000):
+            index = get_log_index(self.log_file, self.index_dir)
+        self.assertGreater(len(index["checkpoints"]), 1)
+        self.assertEqual(index["checkpoints"][0], ["2026-10-18 02:00:00", 0])
+        self.assertEqual(index["last_timestamp"], "2026-10-18 02:59:00")
+        self.assertEqual(index["indexed_to"], os.path.getsize(self.log_file))
+
+    def test_index_extended_incrementally(self):
+        get_log_index(self.log_file, self.index_dir)
+        with open(self.log_file, "a") as f:
+            f.write("INFO 2026-10-18 03:00:00,000 new\nINFO 2026-10-18 03:01")
+        with mock.patch("clicc_devices.log_index._extend_index") as extend:
+            get_log_index(self.log_file, self.index_dir)
+        # Only the new data is read, from where indexing stopped.
+        self.assertEqual(
+            extend.call_args.args[1]["last_timestamp"], "2026-10-18 02:59:00"
+        )
+        index = get_log_index(self.log_file, self.index_dir)
+        # The incomplete last line isn't indexed yet.
+        self.assertEqual(index["last_timestamp"], "2026-10-18 03:00:00")
+
+    def test_filter_by_level(self):
+        records = filter_log_records(self.log_file, self.index_dir, level="ERROR")
+        self.assertEqual(len(records), 9)
+        self.assertTrue(records[0].startswith("ERROR 2026-10-16 02:00:00"))
+        # Tracebacks stay with their records.
+        self.assertIn("Traceback", records[0])
+
+    def test_filter_by_level_limit_returns_most_recent(self):
+        records = filter_log_records(
+            self.log_file, self.index_dir, level="ERROR", limit=2
+        )
+        self.assertTrue(records[0].startswith("ERROR 2026-10-18 02:20:00"))
+        self.assertTrue(records[1].startswith("ERROR 2026-10-18 02:40:00"))
+
+    def test_filter_since_skips_to_region(self):
+        since = datetime(2026, 10, 17, 2, 30)
+        with mock.patch("clicc_devices.log_index.CHECKPOINT_BYTES", 1000):
+            with mock.patch(
+                "clicc_devices.log_index._read_records",
+                wraps=log_index._read_records,
+            ) as read_records:
+                records = filter_log_records(
+                    self.log_file, self.index_dir, level="ERROR", since=since
+                )
+        self.assertEqual(len(records), 4)
+        self.assertTrue(records[0].startswith("ERROR 2026-10-17 02:40:00"))
+        # The oldest file, and the start of the next, are never read.
+        read_paths = [call.args[0] for call in read_records.call_args_list]
+        self.assertNotIn(f"{self.log_file}.2", read_paths)
+        self.assertNotEqual(read_records.call_args_list[0].args[1], 0)
+
+    def test_filter_since_limit_returns_earliest(self):
+        since = datetime(2026, 10, 17, 2, 30)
+        records = filter_log_records(
+            self.log_file, self.index_dir, since=since, limit=1
+        )
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0].startswith("INFO 2026-10-17 02:30:00"))
+
+    def test_show_log_filters(self):
+        with self.settings(LOG_FILE=self.log_file, LOG_INDEX_DIR=self.index_dir):
+            response = self.client.get(
+                "/logs/", {"level": "error", "since": "2026-10-18T02:10"}
+            )
+            self.assertEqual(response.context["log_data"].count("ERROR"), 2)
+            response = self.client.get("/logs/", {"since": "last night"})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get("/logs/", {"level": "LOUD"})
+            self.assertEqual(response.status_code, 400)
+
+
+class LogHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.log_dir.name, "application.log")
+
+    def tearDown(self):
+        self.log_dir.cleanup()
+
+    def make_logger(self, name):
+        handler = MultiProcessRotatingFileHandler(
+            self.log_file, maxBytes=200, backupCount=2
+        )
+        self.addCleanup(handler.close)
+        logger = logging.Logger(name)
+        logger.addHandler(handler)
+        return logger
+
+    def test_rotates_by_size(self):
+        logger = self.make_logger("one")
+        for i in range(20):
+            logger.warning("message %02d %s", i, "x" * 40)
+        self.assertEqual(
+            log_files(self.log_file),
+            [f"{self.log_file}.2", f"{self.log_file}.1", self.log_file],
+        )
+        self.assertLessEqual(os.path.getsize(self.log_file), 200)
+
+    def test_handlers_sharing_a_file_rotate_once(self):
+        # Two handlers stand in for two processes writing to the same log.
+        first = self.make_logger("first")
+        second = self.make_logger("second")
+        for i in range(3):
+            first.warning("first %02d %s", i, "x" * 40)
+        second.warning("second %s", "x" * 40)
+        first.warning("first 03 %s", "x" * 40)
+        # first rotated, so second writes to the new file, not the rotated one.
+        second.warning("second again")
+        with open(self.log_file) as f:
+            current = f.read()
+        self.assertIn("second again", current)
+        self.assertFalse(os.path.exists(f"{self.log_file}.2"))
+        with open(f"{self.log_file}.1") as f:
+            self.assertEqual(f.read().count("second"), 1)
+
+
+class AlmaSetMembersClientTests(SimpleTestCase):
+    def test_get_set_fingerprint(self):
+        client = AlmaSetMembersClient("test")
+        metadata = {"number_of_members": {"value": 3}, "status_date": "2026-01-01Z"}
+        with mock.patch.object(client.session, "get") as mock_get:
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.return_value = metadata
+            fingerprint = client.get_set_fingerprint("set1")
+            self.assertEqual(fingerprint, client.get_set_fingerprint("set1"))
+            metadata["number_of_members"]["value"] = 4
+            self.assertNotEqual(fingerprint, client.get_set_fingerprint("set1"))
+
+    def test_iter_member_pages(self):
+        client = AlmaSetMembersClient("test")
+        responses = [
+            {
+                "member": [{"description": "b1"}, {"description": "b2"}],
+                "total_record_count": 3,
+            },
+            {"member": [{"description": "b3"}], "total_record_count": 3},
+        ]
+        with mock.patch.object(client.session, "get") as mock_get:
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.side_effect = responses
+            pages = list(client.iter_member_pages("set1", page_size=2))
+        self.assertEqual(pages, [["b1", "b2"], ["b3"]])
+        offsets = [call.kwargs["params"]["offset"] for call in mock_get.call_args_list]
+        self.assertEqual(offsets, [0, 2])
+
+    def test_get_set_rate_limits_each_page(self):
+        rate_limiter = mock.Mock()
+        client = AlmaSetMembersClient("test", rate_limiter=rate_limiter)
+        responses = [
+            {"member": [{"description": f"b{i}"}], "total_record_count": 3}
+            for i in range(3)
+        ]
+        with mock.patch.object(client.session, "get") as mock_get:
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.side_effect = responses
+            alma_set = client.get_set("set1", page_size=1)
+        self.assertEqual(
+            [member.description for member in alma_set.members], ["b0", "b1", "b2"]
+        )
+        self.assertEqual(rate_limiter.wait.call_count, 3)
+
+    def test_failed_requests_raise_alma_request_error(self):
+        client = AlmaSetMembersClient("test")
+        with mock.patch.object(client.session, "get") as mock_get:
+            mock_get.side_effect = requests.ConnectionError("Connection reset")
+            with self.assertRaisesRegex(AlmaRequestError, "Connection reset"):
+                client.get_set("set1")
+            mock_get.side_effect = None
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.side_effect = ValueError("Expecting value")
+            with self.assertRaisesRegex(AlmaRequestError, "invalid JSON"):
+                client.get_set("set1")
+
+
+class ConcurrencyTests(SimpleTestCase):
+    def test_run_concurrently_returns_all_results(self):
+        results = dict(run_concurrently(lambda x: x * 2, range(20), workers=4))
+        self.assertEqual(results, {x: x * 2 for x in range(20)})
+
+    def test_run_concurrently_limits_calls_in_progress(self):
+        lock = threading.Lock()
+        in_progress = []
+        peak = []
+
+        def slow(value):
+            with lock:
+                in_progress.append(value)
+                peak.append(len(in_progress))
+            time.sleep(0.01)
+            with lock:
+                in_progress.remove(value)
+            return value
+
+        list(run_concurrently(slow, range(20), workers=3))
+        self.assertLessEqual(max(peak), 3)
+
+    def test_run_concurrently_single_worker_runs_in_order(self):
+        results = [value for value, _ in run_concurrently(str, range(5), workers=1)]
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+
+    def test_rate_limiter_spaces_calls(self):
+        rate_limiter = RateLimiter(max_per_second=100)
+        start = time.monotonic()
+        for _ in range(6):
+            rate_limiter.wait()
+        # First call is immediate; the other 5 are 0.01 seconds apart.
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+
+class BenchmarkTests(TestCase):
+    def test_run_benchmark(self):
+        results = run_benchmark(
+            set_count=4, items_per_set=20, units=2, types=2, repeat=2, churn=0.25
+        )
+        self.assertEqual(
+            set(results),
+            {
+                "generate_data",
+                "devices_uncached",
+                "devices_cached",
+                "view_sets",
+                "view_sets_sorted_by_item_count",
+                "view_sets_filtered",
+                "retrieve_sets",
+            },
+        )
+        self.assertEqual(results["view_sets"]["runs"], 2)
+        self.assertEqual(results["devices_cached"]["queries"], [0, 0])
+        self.assertEqual(results["view_sets"]["content_encoding"], "gzip")
+        self.assertGreater(results["view_sets"]["response_bytes"], 0)
+        self.assertGreater(results["retrieve_sets"]["peak_memory_bytes"], 0)
+        # retrieve_sets replaced a quarter of each set's items from the fake client.
+        self.assertEqual(Item.objects.filter(barcode__contains="-R").count(), 4 * 5)
+        self.assertEqual(Item.objects.count(), 4 * 20)
@@ -5,7 +5,16 @@ urlpatterns = [
     path("", views.view_sets, name="view_sets"),
     path("logs/", views.show_log, name="show_log"),
     path("logs/<int:line_count>", views.show_log, name="show_log"),
+    path("logs/live/", views.show_log_live, name="show_log_live"),
+    path("logs/tail/", views.log_tail, name="log_tail"),
     path("release_notes/", views.release_notes, name="release_notes"),
     path("cron/", views.crontab),
     path("devices/", views.devices, name="devices"),
+    path("devices/history/", views.devices_history, name="devices_history"),
+    path("devices/barcode/", views.bulk_barcode_lookup, name="bulk_barcode_lookup"),
+    path("devices/barcode/<str:barcode>/", views.barcode_lookup, name="barcode_lookup"),
+    path("devices/cache_stats/", views.devices_cache_stats, name="devices_cache_stats"),
+    path("metrics/", views.metrics_endpoint, name="metrics"),
+    path("retrievals/", views.retrieval_history, name="retrieval_history"),
+    path("retrievals/<int:run_id>/", views.retrieval_history, name="retrieval_history"),
 ]
@@ -1,30 +1,179 @@
+from datetime import datetime, time
+import json
+import statistics
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.http import HttpRequest, HttpResponse, JsonResponse
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, urlencode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from clicc_devices.compression import negotiate_encoding
+from clicc_devices.device_data import (
+    devices_cache_totals,
+    get_devices_payload,
+    lookup_barcodes,
+)
 from clicc_devices.forms import CronForm
-from clicc_devices.models import CronJob, Set, Item
+from clicc_devices.log_index import filter_log_records
+from clicc_devices.log_reader import (
+    read_new_lines,
+    tail_lines,
+    tail_lines_with_cursor,
+)
+from clicc_devices.metrics import metrics, render_metrics
+from clicc_devices.models import (
+    CronJob,
+    DeviceCountSnapshot,
+    ItemType,
+    RetrievalRun,
+    Set,
+)
+
+# Sets page: number of Sets per page, and sortable columns
+# mapped to the fields they sort on.
+SETS_PER_PAGE = 50
+SET_SORT_FIELDS = {
+    "name": "name",
+    "unit": "unit",
+    "type": "type__name",
+    "retrieved": "retrieved",
+    "item_count": "item_count",
+}
+SET_COLUMNS = [
+    ("name", "Set Name"),
+    ("unit", "Unit"),
+    ("type", "Type"),
+    ("retrieved", "Last Retrieved"),
+    ("item_count", "Item Count"),
+]
+
+# Live log page: lines shown initially, and seconds between checks for new lines.
+LOG_TAIL_LINES = 200
+LOG_POLL_SECONDS = 5
+# Most barcodes in one bulk barcode lookup.
+MAX_BULK_BARCODES = 5000
+
+# Output formats for /devices/.
+DEVICES_FORMATS = ("nested", "flat")
+
+# Most snapshot rows returned by /devices/history/.
+MAX_HISTORY_ROWS = 10000
+
+# Retrievals page: number of recent runs shown, and of slowest sets in a run.
+RETRIEVAL_RUNS_SHOWN = 30
+SLOWEST_SETS_SHOWN = 20
+
+# Log page: levels which can be filtered on.
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 
 
 def show_log(request: HttpRequest, line_count: int = 200) -> HttpResponse:
     """Display log file in the browser.
 
+    Query parameters:
+    level: Show only records at or above this level, like ERROR.
+    since: Show only records at or after this time, in ISO 8601 format,
+        like 2026-10-18T02:00. Times without a timezone are local time.
+    With either filter, records are found in the log file and its rotated
+    backups via their indexes, and line_count is the number of records shown.
+
     :param request: The HTTP request object.
-    :param line_count: The most recent lines in the log. If not provided, shows the whole log.
+    :param line_count: The number of most recent lines in the log to show,
+        up to settings.LOG_VIEW_MAX_LINES.
     :return: Rendered HTML for the logs.
     """
     log_file = settings.LOG_FILE
+    line_count = min(line_count, settings.LOG_VIEW_MAX_LINES)
+    level = request.GET.get("level", "").upper()
+    since_text = request.GET.get("since", "")
+    context = {"levels": LOG_LEVELS, "selected_level": level, "since": since_text}
+
+    if level and level not in LOG_LEVELS:
+        context["log_data"] = f"Unknown level {level}"
+        return render(request, "log.html", context, status=400)
+    try:
+        since = datetime.fromisoformat(since_text) if since_text else None
+    except ValueError:
+        context["log_data"] = f"Invalid time {since_text}"
+        return render(request, "log.html", context, status=400)
+    if since and since.tzinfo:
+        # Log timestamps are local time, without a timezone.
+        since = since.astimezone().replace(tzinfo=None)
+
     try:
-        with open(log_file, "r") as f:
-            # Get just the last line_count lines in the log.
-            lines = f.readlines()[-line_count:]
+        if level or since:
+            records = filter_log_records(
+                log_file, settings.LOG_INDEX_DIR, level, since, line_count
+            )
+            context["log_data"] = "".join(records)
+        else:
+            # Get just the last line_count lines in the log, without reading all of it.
+            lines = tail_lines(log_file, line_count)
             # Template prints these as a single block, so join lines into one chunk.
-            log_data = "".join(lines)
+            context["log_data"] = "".join(lines)
     except FileNotFoundError:
-        log_data = f"Log file {log_file} not found"
+        context["log_data"] = f"Log file {log_file} not found"
 
-    return render(request, "log.html", {"log_data": log_data})
+    return render(request, "log.html", context)
+
+
+def show_log_live(request: HttpRequest) -> HttpResponse:
+    """Display the end of the log file, updated as new lines are written.
+
+    The page polls log_tail() for new lines.
+
+    :param request: The HTTP request object.
+    :return: Rendered HTML for the logs.
+    """
+    return render(request, "log_live.html", {"poll_seconds": LOG_POLL_SECONDS})
+
+
+def log_tail(request: HttpRequest) -> JsonResponse:
+    """Endpoint to retrieve lines added to the log file since a previous request.
+
+    Query parameters:
+    cursor: Cursor returned by a previous request, made of the log file's
+        inode and a byte offset. If not provided, the most recent lines
+        are returned.
+
+    Example response structure:
+    {
+    "lines": ["INFO 2026-10-18 ...\n", ...],
+    "cursor": "4212345:123456",
+    "reset": false,
+    }
+    reset is true when the log was rotated, replaced or truncated, and lines
+    are from the start of the new log.
+
+    :param request: The HTTP request object.
+    :return: JSON response containing new lines and the cursor for the next request.
+    """
+    log_file = settings.LOG_FILE
+    cursor = request.GET.get("cursor", "")
+    try:
+        if cursor:
+            lines, next_cursor, reset = read_new_lines(log_file, cursor)
+        else:
+            lines, next_cursor = tail_lines_with_cursor(log_file, LOG_TAIL_LINES)
+            reset = False
+    except FileNotFoundError:
+        return JsonResponse({"error": f"Log file {log_file} not found"}, status=404)
+    except ValueError:
+        return JsonResponse({"error": "cursor is not valid"}, status=400)
+    return JsonResponse({"lines": lines, "cursor": next_cursor, "reset": reset})
 
 
 def release_notes(request: HttpRequest) -> HttpResponse:
@@ -38,26 +187,68 @@ def release_notes(request: HttpRequest) -> HttpResponse:
 
 @login_required
 def view_sets(request: HttpRequest) -> HttpResponse:
-    """Display all available Sets.
+    """Display available Sets, one page at a time.
+
+    Query parameters (all optional):
+    unit: Show only Sets for this unit.
+    type: Show only Sets with this item type name.
+    sort: Column to sort by (see SET_SORT_FIELDS), prefixed with "-" for descending.
+    page: Page number.
 
     :param request: The HTTP request object.
     :return: Rendered HTML for the Sets.
     """
 
-    all_sets = Set.objects.all().order_by("name")
-    set_data = []
-    for s in all_sets:
-        set_data.append(
+    unit = request.GET.get("unit", "")
+    item_type = request.GET.get("type", "")
+    sort = request.GET.get("sort", "name")
+    if sort.lstrip("-") not in SET_SORT_FIELDS:
+        sort = "name"
+    descending = sort.startswith("-")
+    sort_field = SET_SORT_FIELDS[sort.lstrip("-")]
+
+    # Item counts and types come from the same query, via annotation and join.
+    sets = Set.objects.select_related("type").annotate(item_count=Count("items"))
+    if unit:
+        sets = sets.filter(unit=unit)
+    if item_type:
+        sets = sets.filter(type__name=item_type)
+    # Include pk as a tie-breaker, so pages are stable.
+    sets = sets.order_by(f"-{sort_field}" if descending else sort_field, "pk")
+
+    paginator = Paginator(sets, SETS_PER_PAGE)
+    page = paginator.get_page(request.GET.get("page"))
+
+    # Links for sorting and paging keep the current filters.
+    filter_query = urlencode(
+        {k: v for k, v in (("unit", unit), ("type", item_type)) if v}
+    )
+    columns = []
+    for name, label in SET_COLUMNS:
+        # Clicking the active column reverses its direction.
+        active = sort.lstrip("-") == name
+        next_sort = f"-{name}" if active and not descending else name
+        columns.append(
             {
-                "name": s.name,
-                "unit": s.unit,
-                "type": s.type.name,
-                "retrieved": s.retrieved,
-                "item_count": Item.objects.filter(set=s).count(),
+                "label": label,
+                "sort_query": urlencode({"sort": next_sort}),
+                "active": active,
+                "descending": descending,
             }
         )
 
-    return render(request, "view_sets.html", {"set_data": set_data})
+    context = {
+        "page": page,
+        "columns": columns,
+        "units": Set.objects.values_list("unit", flat=True).distinct().order_by("unit"),
+        "item_types": ItemType.objects.values_list("name", flat=True).order_by("name"),
+        "selected_unit": unit,
+        "selected_type": item_type,
+        "selected_sort": sort,
+        "filter_query": filter_query,
+        "sort_query": urlencode({"sort": sort}),
+    }
+    return render(request, "view_sets.html", context)
 
 
 @login_required()
@@ -82,11 +273,17 @@ def crontab(request: HttpRequest) -> HttpResponse:
     return render(request, "cron.html", {"form": form})
 
 
-def devices(request: HttpRequest) -> JsonResponse:
-    """Endpoint to retrieve all device data as JSON.
+def devices(request: HttpRequest) -> HttpResponse:
+    """Endpoint to retrieve device data as JSON.
     Data is grouped by Unit. Each Unit contains a dictionary of Item Types
     and their counts.
 
+    Query parameters, all optional:
+    unit: Only this unit.
+    type: Only this item type.
+    format: "nested" (the default), as below, or "flat", for a list like
+        [{"unit": "unit1", "item_type": "typeA", "item_count": 17}, ...].
+
     Example response structure:
     {
     "unit1": {
@@ -99,18 +296,279 @@ def devices(request: HttpRequest) -> JsonResponse:
         },
     }
 
+    The serialized response is cached, shared by all processes, and replaced
+    whenever retrieve_sets rebuilds the data. Responses carry ETag and
+    Last-Modified headers, so repeat requests can get a 304 response.
+    Bodies are compressed when they're cached, and sent compressed to clients
+    which accept brotli or gzip.
+
+    :param request: The HTTP request object.
+    :return: JSON response containing device data, 304 Not Modified,
+        or 400 for an unknown format.
+    """
+    output_format = request.GET.get("format") or "nested"
+    if output_format not in DEVICES_FORMATS:
+        return JsonResponse(
+            {"error": f"format must be one of: {', '.join(DEVICES_FORMATS)}"},
+            status=400,
+        )
+    payload, cache_hit = get_devices_payload(
+        unit=request.GET.get("unit") or None,
+        item_type=request.GET.get("type") or None,
+        flat=output_format == "flat",
+    )
+    # Payloads cached before compression was added have no "encodings".
+    encodings = payload.get("encodings", {})
+    encoding = negotiate_encoding(
+        request.headers.get("Accept-Encoding", ""), available=encodings
+    )
+    # Weak whenever the body would be compressed, as its bytes differ, like
+    # GZipMiddleware; a 304 carries the same ETag as the 200 it revalidates.
+    etag = f"W/{payload['etag']}" if encoding else payload["etag"]
+    response = get_conditional_response(
+        request, etag=etag, last_modified=payload["last_modified"]
+    )
+    if response is None:
+        response = HttpResponse(
+            encodings[encoding] if encoding else payload["body"],
+            content_type="application/json",
+        )
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    patch_vary_headers(response, ["Accept-Encoding"])
+    response.headers["ETag"] = etag
+    if payload["last_modified"]:
+        response.headers["Last-Modified"] = http_date(payload["last_modified"])
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
+    # Allow caching by browsers and CDNs, but always revalidate.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_GET
+def devices_history(request: HttpRequest) -> JsonResponse:
+    """Endpoint to retrieve device counts over time, from the snapshot
+    saved by each retrieve_sets run.
+
+    Query parameters, all optional:
+    unit: Only this unit.
+    type: Only this item type.
+    from: Only snapshots at or after this date or time (ISO 8601, like
+        2026-07-01 or 2026-07-01T08:00). Times without a timezone are local time.
+    to: Only snapshots up to this time, or through the end of this date.
+
+    Example response structure:
+    {
+    "snapshots": [
+        {"unit": "unit1", "item_type": "typeA", "taken": "2026-07-01T02:10:00-07:00",
+            "item_count": 17},
+        ...
+        ],
+    "truncated": false,
+    }
+    Snapshots are ordered by unit, item type, then time. truncated is true
+    if there were more than MAX_HISTORY_ROWS.
+
     :param request: The HTTP request object.
-    :return: JSON response containing all device data.
+    :return: JSON response with the snapshots, or 400 for an invalid date.
     """
+    snapshots = DeviceCountSnapshot.objects.all()
+    if unit := request.GET.get("unit"):
+        snapshots = snapshots.filter(unit=unit)
+    if item_type := request.GET.get("type"):
+        snapshots = snapshots.filter(item_type=item_type)
+    for parameter in ["from", "to"]:
+        value = request.GET.get(parameter)
+        if not value:
+            continue
+        try:
+            moment = _parse_moment(value, end_of_day=parameter == "to")
+        except ValueError:
+            return JsonResponse(
+                {"error": f"{parameter} must be an ISO 8601 date or time"}, status=400
+            )
+        if parameter == "from":
+            snapshots = snapshots.filter(taken__gte=moment)
+        else:
+            snapshots = snapshots.filter(taken__lte=moment)
+
+    rows = list(
+        snapshots.order_by("unit", "item_type", "taken").values(
+            "unit", "item_type", "taken", "item_count"
+        )[: MAX_HISTORY_ROWS + 1]
+    )
+    return JsonResponse(
+        {
+            "snapshots": rows[:MAX_HISTORY_ROWS],
+            "truncated": len(rows) > MAX_HISTORY_ROWS,
+        }
+    )
+
+
+def _parse_moment(value: str, end_of_day: bool = False) -> datetime:
+    # Parse an ISO 8601 date or time, as an aware datetime. A date means
+    # the start of that day, or with end_of_day, the last moment of it.
+    # Dates first, as parse_datetime() would take a date as midnight.
+    if date := parse_date(value):
+        moment = datetime.combine(date, time.max if end_of_day else time.min)
+    elif not (moment := parse_datetime(value)):
+        raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+@require_GET
+def barcode_lookup(request: HttpRequest, barcode: str) -> JsonResponse:
+    """Endpoint to find the set, unit and item type of a device by its barcode.
+
+    Example response structure:
+    {
+    "barcode": "12345",
+    "items": [
+        {"set": "Set 1", "alma_set_id": "123", "unit": "unit1", "item_type": "typeA"},
+        ],
+    }
+    A barcode can be in more than one set, so items is a list.
+
+    :param request: The HTTP request object.
+    :param barcode: The barcode to look up.
+    :return: JSON response with the barcode's items, or 404 if it's not in any set.
+    """
+    items = lookup_barcodes([barcode]).get(barcode)
+    if not items:
+        return JsonResponse({"error": f"Barcode {barcode} not found"}, status=404)
+    return JsonResponse({"barcode": barcode, "items": items})
+
+
+# Called by circulation tools, not from our own forms, so there's no CSRF token.
+@csrf_exempt
+@require_POST
+def bulk_barcode_lookup(request: HttpRequest) -> JsonResponse:
+    """Endpoint to look up many barcodes at once, with a single database query.
+
+    Request body: {"barcodes": ["12345", "67890", ...]}, with up to
+    MAX_BULK_BARCODES barcodes.
+
+    Example response structure:
+    {
+    "results": {
+        "12345": [
+            {"set": "Set 1", "alma_set_id": "123", "unit": "unit1", "item_type": "typeA"},
+            ],
+        },
+    "not_found": ["67890"],
+    }
+
+    :param request: The HTTP request object.
+    :return: JSON response with items for each barcode found, or 400 for an
+        invalid request.
+    """
+    try:
+        barcodes = json.loads(request.body)["barcodes"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {"error": 'Request body must be JSON like {"barcodes": [...]}'}, status=400
+        )
+    if not isinstance(barcodes, list) or not all(
+        isinstance(barcode, str) for barcode in barcodes
+    ):
+        return JsonResponse({"error": "barcodes must be a list of strings"}, status=400)
+    if len(barcodes) > MAX_BULK_BARCODES:
+        return JsonResponse(
+            {"error": f"At most {MAX_BULK_BARCODES} barcodes can be looked up at once"},
+            status=400,
+        )
+    results = lookup_barcodes(barcodes)
+    not_found = [
+        barcode for barcode in dict.fromkeys(barcodes) if barcode not in results
+    ]
+    return JsonResponse({"results": results, "not_found": not_found})
+
+
+@login_required
+def devices_cache_stats(request: HttpRequest) -> JsonResponse:
+    """Endpoint to report hit and miss counts for the /devices/ cache.
+
+    :param request: The HTTP request object.
+    :return: JSON response with counts across all processes.
+    """
+    return JsonResponse(devices_cache_totals())
+
+
+def metrics_endpoint(request: HttpRequest) -> HttpResponse:
+    """Endpoint for Prometheus to scrape application metrics.
+
+    Metrics are shared by all processes, including retrieve_sets runs.
+    If settings.METRICS_TOKEN is set, requests must send it as a bearer token.
+
+    :param request: The HTTP request object.
+    :return: Metrics in the Prometheus text format, or 401 Unauthorized.
+    """
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+    # Include this process's latest counts.
+    metrics.flush()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@staff_member_required
+def retrieval_history(request: HttpRequest, run_id: int | None = None) -> HttpResponse:
+    """Display recent retrieve_sets runs, and where the time went in one of them.
+
+    Shows the recent runs with their durations and item changes, the median (p50)
+    and 95th percentile (p95) run durations, and for the selected run (by default,
+    the latest), p50 and p95 times per set and the slowest sets.
+
+    :param request: The HTTP request object.
+    :param run_id: ID of the RetrievalRun to show in detail.
+    :return: Rendered HTML for the retrieval history.
+    """
+    runs = list(
+        RetrievalRun.objects.annotate(
+            added=Sum("set_retrievals__added"),
+            removed=Sum("set_retrievals__removed"),
+        )[:RETRIEVAL_RUNS_SHOWN]
+    )
+    if run_id is not None:
+        run = get_object_or_404(RetrievalRun, pk=run_id)
+    else:
+        run = runs[0] if runs else None
+
+    context = {
+        "runs": runs,
+        "run": run,
+        "run_durations": _percentiles(
+            [each.duration for each in runs if each.duration is not None]
+        ),
+    }
+    if run:
+        synced = run.set_retrievals.filter(result="synced")
+        timings = list(synced.values_list("alma_seconds", "write_seconds"))
+        context["set_durations"] = [
+            ("Alma", _percentiles([alma or 0 for alma, _ in timings])),
+            ("Database", _percentiles([write or 0 for _, write in timings])),
+            (
+                "Total",
+                _percentiles([(alma or 0) + (write or 0) for alma, write in timings]),
+            ),
+        ]
+        context["slowest_sets"] = synced.annotate(
+            total=Coalesce(F("alma_seconds"), Value(0.0))
+            + Coalesce(F("write_seconds"), Value(0.0))
+        ).order_by("-total")[:SLOWEST_SETS_SHOWN]
+        context["failed_sets"] = run.set_retrievals.filter(result="failed")
+    return render(request, "retrieval_history.html", context)
+
 
-    all_sets = Set.objects.all().order_by("unit", "type__name")
-    unit_data = {}
-    for s in all_sets:
-        items = Item.objects.filter(set=s)
-        if s.unit not in unit_data:
-            unit_data[s.unit] = {}
-        if s.type.name not in unit_data[s.unit]:
-            unit_data[s.unit][s.type.name] = 0
-        unit_data[s.unit][s.type.name] += items.count()
-
-    return JsonResponse(unit_data)
+def _percentiles(values: list[float]) -> dict:
+    # Median and 95th percentile, or None for both without any values.
+    if not values:
+        return {"p50": None, "p95": None}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0]}
+    cut_points = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cut_points[49], "p95": cut_points[94]}
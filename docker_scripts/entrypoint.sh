@@ -19,6 +19,10 @@ done
 # Run database migrations
 python manage.py migrate
 
+# Publish the static export of /devices/, which isn't in the image;
+# retrieve_sets keeps it up to date after this.
+python manage.py export_devices
+
 # Start cron (via sudo).
 # sudo access was set up in Dockerfile and is limited to this one command.
 sudo /usr/sbin/service cron start
@@ -60,8 +60,15 @@ MIDDLEWARE = [
     # corsheaders should be as early as possible in this list
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    # Enable whitenoise in production too
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Enable whitenoise in production too; this subclass also serves
+    # the static export of /devices/.
+    "clicc_devices.middleware.DevicesExportMiddleware",
+    # After whitenoise, so static files aren't timed; before the rest,
+    # so their queries (sessions, users) are included.
+    "clicc_devices.middleware.QueryTimingMiddleware",
+    # Outside the CSRF middleware, so it can tell which responses have a token;
+    # inside query timing, so compression counts towards the time taken.
+    "clicc_devices.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -144,6 +151,35 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 if not os.path.isdir(STATIC_ROOT):
     os.makedirs(STATIC_ROOT, mode=0o755)
 
+# Static export of /devices/, written whenever the device summary is rebuilt,
+# and served by clicc_devices.middleware.DevicesExportMiddleware.
+DEVICES_EXPORT_DIR = os.getenv(
+    "DJANGO_DEVICES_EXPORT_DIR", os.path.join(BASE_DIR, "export")
+)
+DEVICES_EXPORT_URL = "/export/"
+
+
+# Caching
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The "devices" cache holds the serialized /devices/ response. It's file-based
+# so all gunicorn workers, and the cron-launched retrieve_sets command which
+# refreshes it, share the same data. The "devices_state" cache holds the
+# generation of filtered payloads; it only has one key, so unlike the
+# "devices" cache, it never reaches MAX_ENTRIES and culls it.
+CACHE_DIR = os.getenv("DJANGO_CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "devices": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(CACHE_DIR, "devices"),
+    },
+    "devices_state": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(CACHE_DIR, "devices_state"),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -158,6 +194,14 @@ if not os.path.isdir(LOG_DIR):
     os.makedirs(LOG_DIR, mode=0o755)
 
 LOG_FILE = os.path.join(LOG_DIR, "application.log")
+# Rotate the log at this size, keeping this many old files
+# (application.log.1 is the most recent).
+LOG_MAX_BYTES = int(os.getenv("DJANGO_LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("DJANGO_LOG_BACKUP_COUNT", "10"))
+# Timestamp to byte offset indexes for the log files, used by the log viewer's filters.
+LOG_INDEX_DIR = os.path.join(LOG_DIR, ".index")
+# Most lines the log viewer will show at once.
+LOG_VIEW_MAX_LINES = 5000
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -173,8 +217,12 @@ LOGGING = {
             "class": "logging.StreamHandler",
         },
         "file": {
-            "class": "logging.FileHandler",
+            # Rotates safely with several processes (web workers, cron jobs)
+            # writing to the same file.
+            "class": "clicc_devices.log_handlers.MultiProcessRotatingFileHandler",
             "filename": LOG_FILE,
+            "maxBytes": LOG_MAX_BYTES,
+            "backupCount": LOG_BACKUP_COUNT,
             "formatter": "verbose",
         },
     },
@@ -187,8 +235,28 @@ LOGGING = {
     },
 }
 
+# Per-request query timing, by clicc_devices.middleware.QueryTimingMiddleware.
+# Requests taking at least this long are logged as warnings, with their slowest queries.
+SLOW_REQUEST_MS = float(os.getenv("DJANGO_SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_QUERIES = 5
+# Requests which aren't logged (but still get Server-Timing headers).
+QUERY_TIMING_EXCLUDE_PATHS = ["/logs/", "/metrics/"]
+# If set, /metrics/ requires this as a bearer token (bearer_token in Prometheus).
+METRICS_TOKEN = os.getenv("DJANGO_METRICS_TOKEN")
+
+# Responses smaller than this aren't compressed by
+# clicc_devices.middleware.CompressionMiddleware, nor cached /devices/ payloads.
+COMPRESSION_MIN_BYTES = int(os.getenv("DJANGO_COMPRESSION_MIN_BYTES", "1024"))
+
 # Alma API credentials
 ALMA_API_KEY = os.getenv("ALMA_API_KEY")
+# Ceiling on Alma requests per second made by retrieve_sets, across all of its
+# workers. Alma's own limit is per institution, so leave room for other applications.
+ALMA_MAX_REQUESTS_PER_SECOND = float(os.getenv("ALMA_MAX_REQUESTS_PER_SECOND", "10"))
+# Where retrieve_sets --client record saves sets, for --client replay.
+ALMA_RECORDING_DIR = os.getenv(
+    "ALMA_RECORDING_DIR", os.path.join(BASE_DIR, "alma_recordings")
+)
 
 # CORS headers configuration, to allow our API responses
 # to be used by our own websites.
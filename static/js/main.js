@@ -1 +1,43 @@
 // Custom javascript goes in this file.
+
+// Live log view: append lines added to the log since the last check.
+// Each request sends the cursor (log file inode and byte offset) from the
+// previous response, so only new lines are read and transferred.
+document.addEventListener("DOMContentLoaded", () => {
+    const log = document.getElementById("live-log");
+    if (!log) {
+        return;
+    }
+    const tailUrl = log.dataset.tailUrl;
+    const pollMilliseconds = Number(log.dataset.pollSeconds) * 1000;
+    let cursor = null;
+
+    async function poll() {
+        const url = cursor === null ? tailUrl : `${tailUrl}?cursor=${encodeURIComponent(cursor)}`;
+        try {
+            const response = await fetch(url);
+            const data = await response.json();
+            if (response.ok) {
+                if (data.reset) {
+                    log.textContent = "";
+                }
+                if (data.lines.length) {
+                    // Only keep following the end if the reader hasn't scrolled up.
+                    const atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 5;
+                    log.append(data.lines.join(""));
+                    if (atBottom) {
+                        window.scrollTo(0, document.body.scrollHeight);
+                    }
+                }
+                cursor = data.cursor;
+            } else {
+                log.textContent = data.error;
+            }
+        } catch (error) {
+            // Network errors are temporary; try again at the next poll.
+        }
+        setTimeout(poll, pollMilliseconds);
+    }
+
+    poll();
+});